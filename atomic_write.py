@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import tempfile
+
+def atomic_write(path, data, durable=False):
+    """ Write data (str or bytes) to path without ever leaving a partially
+    written file behind: the data is written to a temporary file in the same
+    directory, which is then renamed over path.
+    :param path: file to write
+    :param data: str (written as UTF-8) or bytes
+    :param durable: if true, the data and the rename are flushed to disk
+    before returning, so that they survive a power loss; this is only worth
+    its cost for files that can't be regenerated
+    :return: None
+    """
+    atomic_write_chunks(path, [data], durable)
+
+def atomic_write_chunks(path, chunks, durable=False):
+    """ Like atomic_write, but for data that arrives in pieces (e.g. from a
+    template being rendered with Template.generate), so that it never has to
+    be held in memory all at once.
+    :param path: file to write
+    :param chunks: iterable of str (written as UTF-8) or of bytes
+    :param durable: as for atomic_write
+    :return: None
+    """
+    path = pathlib.Path(path)
+    mode = path.stat().st_mode & 0o777 if path.exists() else 0o644
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            if durable:
+                # otherwise the rename can reach the disk before the data does
+                file.flush()
+                os.fsync(file.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    if durable:
+        fsync_dir(path.parent)
+
+def fsync_dir(path):
+    "flushes a directory's entries (e.g. a rename into it) to disk"
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
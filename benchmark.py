@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import collections
+import gc
+import importlib.util
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+REPO = pathlib.Path(__file__).resolve().parent
+
+# modules that the build imports: packages from PyPI, and helper modules that aren't part of this repo
+PACKAGES = ["flask", "markdown", "markupsafe"]
+HELPERS = ["human_sort", "get_files"]
+
+def check_dependencies():
+    "raises a ClickException naming any modules the build needs that can't be imported"
+    missing_packages = [m for m in PACKAGES if importlib.util.find_spec(m) is None]
+    missing_helpers = [m for m in HELPERS if importlib.util.find_spec(m) is None]
+
+    problems = []
+    if missing_packages:
+        problems += [f"install {', '.join(missing_packages)} (e.g. with pip)"]
+    if missing_helpers:
+        problems += [f"put the helper modules {', '.join(missing_helpers)} on PYTHONPATH; they are imported by the build but aren't part of this repository"]
+    if problems:
+        raise click.ClickException("can't run the benchmarks: " + "; ".join(problems))
+
+def generate_corpus(dest, families=2, sites=3, items=500, models=200, patterns=3, relation_groups=300, extra_info_files=1, seed=0):
+    """ Writes a synthetic corpus to dest: a master config, site configs,
+    info files, models files, model info, relation files, and a copy of this
+    repo's templates and static files.
+    :param families: number of site families
+    :param sites: number of sites per family
+    :param items: number of items per site
+    :param models: number of models
+    :param patterns: number of item patterns per model on each site it appears on
+    :param relation_groups: number of relation groups between random items
+    :param extra_info_files: number of extra info files per site
+    :return: the path of the master config
+    """
+    rng = random.Random(seed)
+    dest = pathlib.Path(dest)
+
+    def word():
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).title()
+
+    shutil.copytree(REPO/"templates", dest/"templates", dirs_exist_ok=True)
+    shutil.copytree(REPO/"static", dest/"static", dirs_exist_ok=True)
+    (dest/"static"/"model-images").mkdir(exist_ok=True)
+    (dest/"static"/"default-model-img.jpg").write_bytes(b"")
+    (dest/"html"/"sites").mkdir(parents=True, exist_ok=True)
+    (dest/"html"/"models").mkdir(parents=True, exist_ok=True)
+
+    model_info = {}
+    for _ in range(models):
+        model_id = "".join(rng.choices(string.ascii_letters + string.digits, k=8))
+        model = {"name": f"{word()} {word()}", "biography": f"## Biography\n\n{word()} {word()} {word()}.", "links": [f"[{word()}](https://example.com/{model_id})"]}
+        if rng.random() < 0.3:
+            model["aliases"] = [word()]
+        if rng.random() < 0.1:
+            model["display_name"] = word()
+        model_info[model_id] = model
+
+    (dest/"data").mkdir(exist_ok=True)
+    (dest/"data"/"model-info.json").write_text(json.dumps(model_info, indent=4, sort_keys=True))
+    (dest/"data"/"private-models.json").write_text("[]")
+
+    family_configs = {}
+    site_items = {}
+    for f in range(families):
+        family = f"family{f}"
+        family_configs[family] = {}
+
+        for s in range(sites):
+            site_id = f"{family}/site{s}"
+            site_dir = dest/"data"/family/f"site{s}"
+            site_dir.mkdir(parents=True, exist_ok=True)
+
+            item_ids = [f"s{s}v{n:05d}" for n in range(items)]
+            site_items[site_id] = item_ids
+
+            info = {}
+            for n, item_id in enumerate(item_ids):
+                info[item_id] = {
+                        "name": f"{word()} {word()}",
+                        "date": f"{2010 + n * 10 // items}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                        "size": {rng.choice(["duration", "images"]): str(rng.randint(1, 200))},
+                        "previews": [f"https://example.com/{site_id}/{item_id}.jpg"],
+                        "url": f"https://example.com/{site_id}/{item_id}",
+                        }
+            (site_dir/"info.json").write_text(json.dumps(info, indent=4))
+
+            extra_files = []
+            for e in range(extra_info_files):
+                extra = {item_id: {"price": f"{rng.randint(1, 30)}.99"} for item_id in rng.sample(item_ids, len(item_ids) // 4)}
+                (site_dir/f"extra{e}.json").write_text(json.dumps(extra, indent=4))
+                extra_files += [f"extra{e}.json"]
+
+            site_models = {}
+            for model_id in rng.sample(list(model_info), min(len(model_info), max(1, models // 4))):
+                credits = []
+                for _ in range(patterns):
+                    item_id = rng.choice(item_ids)
+                    credits += [rng.choice([item_id, item_id[:-1] + "?", item_id[:-2] + "*", "{" + item_id + "," + rng.choice(item_ids) + "}"])]
+                if rng.random() < 0.2:
+                    credits = [{"items": credits, "credited_as": word()}]
+                site_models[model_id] = credits
+            (site_dir/"models.json").write_text(json.dumps(site_models, indent=4))
+
+            config = {
+                    "name": f"Site {f}.{s}",
+                    "primary_info_file": "info.json",
+                    "extra_info_files": extra_files,
+                    "models_file": "models.json",
+                    "shortcuts": ["latest_video", "latest_photo"],
+                    }
+            (site_dir/"config.json").write_text(json.dumps(config, indent=4))
+            family_configs[family][site_id] = f"data/{family}/site{s}/config.json"
+
+    # relations are kept within a family, one file per family, and each item is in at most one group
+    relations_dir = dest/"data"/"relations"
+    relations_dir.mkdir(exist_ok=True)
+    unrelated = {site_id: rng.sample(item_ids, len(item_ids)) for site_id, item_ids in site_items.items()}
+    relation_files = collections.defaultdict(list)
+    for _ in range(relation_groups):
+        family = rng.choice(list(family_configs))
+        site_ids = [site_id for site_id in family_configs[family] if unrelated[site_id]]
+        if len(site_ids) < 2:
+            continue
+        group = [site_id.split("/", 1)[1] + "/" + unrelated[site_id].pop() for site_id in rng.sample(site_ids, rng.randint(2, len(site_ids)))]
+        relation_files[family] += [group]
+    for family, groups in relation_files.items():
+        (relations_dir/f"{family}.json").write_text(json.dumps({family: groups}, indent=4))
+
+    global_config = {
+            "index_root": "html",
+            "static_files": "static",
+            "models_file": "data/model-info.json",
+            "private_models_file": "data/private-models.json",
+            "relations_dir": "data/relations",
+            "cache_dir": ".cache",
+            "families": family_configs,
+            }
+    (dest/"config.json").write_text(json.dumps(global_config, indent=4))
+
+    return dest/"config.json"
+
+def measure(func, repeat):
+    "calls func repeat times and returns the wall-clock time of each call in seconds"
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times += [time.perf_counter() - start]
+    return times
+
+def benchmarks(config_file):
+    """ Returns a mapping of benchmark names to functions to time, for the
+    corpus described by config_file. manage.py is pointed at the corpus
+    through CANON_CONFIG, so it must not have been imported yet.
+    """
+    os.environ["CANON_CONFIG"] = str(config_file)
+
+    import manage
+    from corpus import Corpus
+    from model import ModelInfo, SiteModelInfo
+    from relation import RelationInfo
+    from search import NameSearchIndex
+
+    root = config_file.parent
+    global_config = json.loads(config_file.read_text())
+    cache_dir = root/global_config["cache_dir"]
+
+    def fresh_corpus(cached=True):
+        if not cached:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return Corpus(root, global_config)
+
+    loaded = fresh_corpus()
+    loaded.load_sites()
+    model_info = ModelInfo(root/global_config["models_file"])
+    queries = [name[:len(name) // 2 + 1] for model in list(model_info.values())[:20] for name in model.searchable_names[:1]]
+    search_index = NameSearchIndex(model_info)
+
+    def render_all():
+        manage.corpus = fresh_corpus()
+        for site_id in manage.corpus.site_ids:
+            manage.write_site_page(site_id)
+        for model_id in manage.corpus.model_info:
+            manage.write_model_page(model_id, False)
+        manage.write_models_index()
+        manage.write_base_page()
+
+    return {
+            "load_sites_cold": lambda: fresh_corpus(cached=False).load_sites(),
+            "load_sites_warm": lambda: fresh_corpus().load_sites(),
+            "site_model_info": lambda: [
+                    [smi.models[model_id] for model_id in smi.models]
+                    for site_id, site in loaded.sites.items()
+                    for smi in [SiteModelInfo(loaded.site_models_file(site_id), model_info, site)]
+                    ],
+            "relations_cold": lambda: RelationInfo(root/global_config["relations_dir"], loaded.sites),
+            "relations_warm": lambda: RelationInfo(root/global_config["relations_dir"], loaded.sites, cache_dir),
+            "extensive_name_search": lambda: [model_info.extensive_name_search(q) for q in queries],
+            "name_search_index": lambda: [search_index.search(q) for q in queries],
+            "model_appearances": lambda: fresh_corpus().model_appearances,
+            "render_all": render_all,
+            }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+corpus_options = [
+        click.option("--families", default=2, help="number of site families"),
+        click.option("--sites", default=3, help="number of sites per family"),
+        click.option("--items", default=500, help="number of items per site"),
+        click.option("--models", default=200, help="number of models"),
+        click.option("--patterns", default=3, help="number of item patterns per model on each site"),
+        click.option("--relation-groups", default=300, help="number of relation groups"),
+        click.option("--extra-info-files", default=1, help="number of extra info files per site"),
+        click.option("--seed", default=0, help="random seed for the generated corpus"),
+        ]
+
+def with_corpus_options(func):
+    for option in reversed(corpus_options):
+        func = option(func)
+    return func
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.argument("dest", type=click.Path(file_okay=False, path_type=pathlib.Path))
+@with_corpus_options
+def generate(dest, **params):
+    "Write a synthetic corpus to DEST."
+    print(generate_corpus(dest, **params))
+
+@cli.command()
+@click.option("--corpus", "corpus_dir", type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path), help="run on an existing corpus instead of generating one")
+@click.option("--repeat", default=5, help="number of times to run each benchmark")
+@click.option("--only", multiple=True, help="only run these benchmarks")
+@click.option("--output", type=click.Path(dir_okay=False, path_type=pathlib.Path), help="write the results here as JSON instead of to stdout")
+@with_corpus_options
+def run(corpus_dir, repeat, only, output, **params):
+    "Time each stage of the build on a synthetic corpus."
+    check_dependencies()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if corpus_dir is None:
+            config_file = generate_corpus(pathlib.Path(temp_dir), **params)
+        else:
+            config_file = corpus_dir/"config.json"
+            params = None
+
+        results = {}
+        for name, func in benchmarks(config_file).items():
+            if only and name not in only:
+                continue
+            times = measure(func, repeat)
+            results[name] = {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times), "times": times}
+            print(f"{name:24} {min(times):9.4f}s min {statistics.median(times):9.4f}s median", file=sys.stderr)
+
+    report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "corpus": params if params is not None else str(corpus_dir),
+            "repeat": repeat,
+            "results": results,
+            }
+
+    js = json.dumps(report, indent=4)
+    if output is None:
+        print(js)
+    else:
+        output.write_text(js + "\n")
+
+if __name__ == "__main__":
+    cli()
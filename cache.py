@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import pickle
+
+from atomic_write import atomic_write
+
+# bump this whenever the structure of cached objects changes
+CACHE_VERSION = 3
+
+def file_key(*paths):
+    "returns a key that changes whenever any of the given files is modified"
+    key = []
+    for path in paths:
+        stat = path.stat()
+        key += [(str(path), stat.st_mtime_ns, stat.st_size)]
+    return tuple(key)
+
+def load(cache_file, key):
+    "returns the value stored in cache_file if it was stored under key, otherwise None"
+    try:
+        with open(cache_file, "rb") as file:
+            if pickle.load(file) != (CACHE_VERSION, key):
+                return None
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"ignoring unreadable cache file {cache_file} ({e!r})")
+        return None
+
+def store(cache_file, key, value):
+    if not cache_file.parent.exists():
+        cache_file.parent.mkdir(parents=True)
+
+    # the key is pickled separately so that stale entries can be rejected without unpickling the value
+    data = pickle.dumps((CACHE_VERSION, key), protocol=pickle.HIGHEST_PROTOCOL)
+    data += pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    atomic_write(cache_file, data)
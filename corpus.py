@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import collections
+import collections.abc
+import functools
+import json
+import pathlib
+
+import cache
+import item
+
+from item import SiteInfo
+from model import ModelInfo, SiteModelInfo
+from relation import RelationInfo
+
+# an item on a model's page; internal_url is relative to the sites directory
+ItemLink = collections.namedtuple("ItemLink", ("item_id", "sort_key", "internal_url", "name"))
+
+class Corpus:
+    "everything described by a master config; each part is loaded the first time it is needed and then reused"
+
+    class Sites(collections.abc.Mapping):
+        "a mapping of site IDs to SiteInfo objects for every site that isn't a work in progress; sites are loaded on first access"
+
+        def __init__(self, corpus):
+            self.corpus = corpus
+
+        def __getitem__(self, site_id):
+            if site_id not in self.corpus.site_ids:
+                raise KeyError(site_id)
+            return self.corpus.site(site_id)
+
+        def __iter__(self):
+            return iter(self.corpus.site_ids)
+
+        def __len__(self):
+            return len(self.corpus.site_ids)
+
+    class SiteSummaries(Sites):
+        "a mapping of site IDs to site summaries (see Corpus.site_summary) for every site that isn't a work in progress"
+
+        def __getitem__(self, site_id):
+            if site_id not in self.corpus.site_ids:
+                raise KeyError(site_id)
+            return self.corpus.site_summary(site_id)
+
+    def __init__(self, root, global_config):
+        if isinstance(root, str):
+            root = pathlib.Path(root)
+
+        self.root = root
+        self.global_config = global_config
+        self.cache_dir = root/global_config.get("cache_dir", ".cache")
+
+        self._site_configs = {}
+        self._sites = {}
+        self._site_summaries = {}
+        self._site_model_infos = {}
+
+    @functools.cached_property
+    def site_config_locations(self):
+        "a mapping of site IDs to the locations of their configs, in family order"
+        return {
+                site_id: config_location
+                for site_configs in self.global_config["families"].values()
+                for site_id, config_location in site_configs.items()
+                }
+
+    @functools.cached_property
+    def site_families(self):
+        "a mapping of site IDs to the names of their families"
+        return {
+                site_id: family
+                for family, site_configs in self.global_config["families"].items()
+                for site_id in site_configs
+                }
+
+    @functools.cached_property
+    def site_ids(self):
+        "the IDs of all sites that aren't works in progress, in family order"
+        return tuple(s for s in self.site_config_locations if "wip" not in self.site_config(s).get("tags", []))
+
+    def load_site_config(self, config_location):
+        if str(config_location).startswith("$extra_configs/"):
+            return self.global_config["extra_configs"][config_location.removeprefix("$extra_configs/")]
+        else:
+            with (self.root/config_location).open() as file:
+                return json.load(file)
+
+    def site_config(self, site_id):
+        if site_id not in self._site_configs:
+            self._site_configs[site_id] = self.load_site_config(self.site_config_locations[site_id])
+        return self._site_configs[site_id]
+
+    def site_root(self, site_id):
+        config_location = self.site_config_locations[site_id]
+        if config_location.startswith("$extra_configs/"):
+            return self.root
+        else:
+            return (self.root/config_location).parent
+
+    def site_id_for_config(self, config_location):
+        "returns the ID of the site whose config file is at config_location, or None"
+        config_location = pathlib.Path(config_location).resolve()
+
+        for site_id, _config_location in self.site_config_locations.items():
+            if _config_location.startswith("$extra_configs/"):
+                continue
+            if config_location == (self.root/_config_location).resolve():
+                return site_id
+
+    def site(self, site_id):
+        if site_id not in self._sites:
+            self._sites[site_id] = SiteInfo(site_id, self.site_config(site_id), self.site_root(site_id), self.cache_dir)
+        return self._sites[site_id]
+
+    def load_sites(self, site_ids=None):
+        "loads the given sites (by default, every site that isn't a work in progress) and returns a mapping of site IDs to Site objects"
+        if site_ids is None:
+            site_ids = self.site_ids
+        return {site_id: self.site(site_id) for site_id in site_ids}
+
+    @property
+    def sites(self):
+        return self.Sites(self)
+
+    def site_summary(self, site_id):
+        """ Returns a mapping of the site's item IDs to ItemSummaries. If the
+        site hasn't been loaded, the summary is read from the cache if its
+        info files haven't changed, so that linking to a site's items doesn't
+        require loading the whole site.
+        """
+        if site_id not in self._site_summaries:
+            if site_id in self._sites:
+                summary = self._sites[site_id].summary()
+            else:
+                config = self.site_config(site_id)
+                cache_file = self.cache_dir/"summaries"/f"{site_id}.pickle"
+                key = (cache.file_key(*item.info_files(config, self.site_root(site_id))), site_id, item.site_name(config))
+
+                if (summary := cache.load(cache_file, key)) is None:
+                    summary = self.site(site_id).summary()
+                    cache.store(cache_file, key, summary)
+
+            self._site_summaries[site_id] = summary
+
+        return self._site_summaries[site_id]
+
+    @functools.cached_property
+    def model_info(self):
+        return ModelInfo(self.root/self.global_config["models_file"])
+
+    @functools.cached_property
+    def relations(self):
+        return RelationInfo(self.root/self.global_config["relations_dir"], self.SiteSummaries(self), self.cache_dir)
+
+    @functools.cached_property
+    def model_appearances(self):
+        """ A mapping of model IDs to {site ID: [ItemLink, ...]} for the sites
+        (in family order) that the model appears on, with each site's items
+        in human sort order. Built in one pass over every site's models file.
+        """
+        appearances = collections.defaultdict(dict)
+
+        for site_id in self.site_ids:
+            site = self.site(site_id)
+            models = self.site_model_info(site_id).models
+
+            for model_id in models:
+                item_ids = sorted(models[model_id], key=lambda item_id: site[item_id].human_sort_key)
+                appearances[model_id][site_id] = [
+                        ItemLink(item_id, site[item_id].sort_key, site[item_id]["internal_url"], site[item_id].get("name", None))
+                        for item_id in item_ids
+                        ]
+
+        return dict(appearances)
+
+    def site_models_file(self, site_id):
+        site = self.site(site_id)
+        if "models_file" in site.config:
+            return site.root/site.config["models_file"]
+        else:
+            return None
+
+    def site_model_info(self, site_id):
+        if site_id not in self._site_model_infos:
+            site = self.site(site_id)
+            self._site_model_infos[site_id] = SiteModelInfo(self.site_models_file(site_id), self.model_info, site)
+        return self._site_model_infos[site_id]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import pathlib
+import subprocess
+import threading
+import time
+
+from atomic_write import atomic_write
+
+# variant suffix -> (width, height); "" is the full-size image that model pages link to
+VARIANTS = {"": (200, 300), "-thumb": (100, 150)}
+FORMATS = ["jpg", "webp"]
+
+class ModelImages:
+    """ The model images in a directory, scanned once into memory instead of
+    checking for each model's image on disk every time it is needed. The
+    directory is rescanned when its mtime changes, which happens whenever an
+    image (or the manifest) is added, removed or replaced by a rename, but
+    it is only stat'ed once every check_interval seconds.
+
+    The manifest (manifest.json in the same directory) records, for each
+    model ID, a hash of the source the images were made from and the file
+    name and dimensions of each variant written by prepare().
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, image_dir, check_interval=1):
+        self.image_dir = image_dir
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.images = set()
+        self.manifest = {}
+        self.checked = None
+        self.refresh()
+
+    def refresh(self, force=False):
+        "rescans the directory if it has changed since the last scan"
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < self.check_interval:
+            return
+
+        with self.lock:
+            self.checked = now
+            mtime = self.image_dir.stat().st_mtime_ns if self.image_dir.exists() else None
+            if mtime == self.mtime and not force:
+                return
+
+            if (manifest_file := self.image_dir/self.MANIFEST).exists():
+                self.manifest = json.loads(manifest_file.read_text())
+            else:
+                self.manifest = {}
+
+            # the smaller variants are not model images in their own right
+            variants = {
+                    pathlib.Path(variant["file"]).stem
+                    for model_id, entry in self.manifest.items() for variant in entry["variants"]
+                    if pathlib.Path(variant["file"]).stem != model_id
+                    }
+            self.images = {path.stem for path in self.image_dir.glob("*.jpg")} - variants
+            self.mtime = mtime
+
+    def __contains__(self, model_id):
+        self.refresh()
+        return model_id in self.images
+
+    def variants(self, model_id):
+        "returns the manifest's list of variants ({file, format, width, height}) of the model's image, or [] if it has none"
+        self.refresh()
+        if model_id not in self.images:
+            return []
+        return self.manifest.get(model_id, {}).get("variants", [])
+
+    def is_current(self, model_id, image):
+        "returns whether the model's images were made from this source image and are all still there"
+        self.refresh()
+        entry = self.manifest.get(model_id)
+        return (
+                entry is not None
+                and entry["source"] == file_hash(image)
+                and all((self.image_dir/variant["file"]).exists() for variant in entry["variants"])
+                )
+
+    def prepare(self, model_id, image, force=True):
+        """ Writes every variant of the model's image, in every format, from
+        the source image file and records them in the manifest. Unless force
+        is true, nothing is done if the images are already current.
+        :return: whether the images were written
+        """
+        if not force and self.is_current(model_id, image):
+            return False
+
+        variants = []
+        for suffix, (width, height) in VARIANTS.items():
+            for fmt in FORMATS:
+                r = subprocess.run(
+                        [
+                            "magick", "convert", str(image),
+                            "-resize", f"x{height}",
+                            "-gravity", "center",
+                            "-background", "white",
+                            "-extent", f"{width}x{height}",
+                            f"{fmt}:-"
+                            ],
+                        stdout=subprocess.PIPE,
+                        check=True
+                        )
+                atomic_write(self.image_dir/f"{model_id}{suffix}.{fmt}", r.stdout)
+                variants += [{"file": f"{model_id}{suffix}.{fmt}", "format": fmt, "width": width, "height": height}]
+
+        source = file_hash(image)
+        with self.lock:
+            manifest_file = self.image_dir/self.MANIFEST
+            manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+            manifest[model_id] = {"source": source, "variants": variants}
+            atomic_write(manifest_file, json.dumps(manifest, indent=4, sort_keys=True))
+
+        self.refresh(force=True)
+        return True
+
+def file_hash(path):
+    return hashlib.sha1(pathlib.Path(path).read_bytes()).hexdigest()
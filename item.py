@@ -1,28 +1,73 @@
 #!/usr/bin/env python3
 
+import bisect
 import collections
-import functools
 import json
+import math
 import pathlib
 
-from model import SiteModelInfo
+import cache
+
+from model import ItemIdIndex, SiteModelInfo
+from slotted import SlottedMapping
 from human_sort import human_sort
 
+SitePage = collections.namedtuple("SitePage", ("label", "file", "item_ids"))
+# just enough about an item to link to it from another site's page
+ItemSummary = collections.namedtuple("ItemSummary", ("item_id", "internal_url", "site_name"))
+
+def site_name(config):
+    "returns the name a site is displayed with, including its dates if it is tagged show_dates"
+    name = config["name"]
+    if "show_dates" in config.get("tags", []):
+        name += f" ({config['dates'][0] or ''}–{config['dates'][1] or ''})"
+    return name
+
+def info_files(config, root):
+    "returns the site's primary info file followed by its extra info files"
+    return [root/config["primary_info_file"]] + [root/f for f in config.get("extra_info_files", [])]
+
 class SiteInfo(collections.UserDict):
 
-    def __init__(self, site_id, config, root):
+    SHORTCUTS = {
+            "latest_video": {"label": "Latest video", "kind": "duration"},
+            "latest_photo": {"label": "Latest photoset", "kind": "images"},
+            }
+
+    def __init__(self, site_id, config, root, cache_dir=None):
 
         self.site_id = site_id
         self.config = config
         self.root = root
 
-        self.site_name = self.config["name"]
-        if "show_dates" in self.config.get("tags", []):
-            self.site_name += f" ({self.config['dates'][0] or ''}–{self.config['dates'][1] or ''})"
+        self._order = None
+        self._positions = None
+        self._date_index = None
+        self._id_index = None
+
+        self.site_name = site_name(self.config)
+        self.info_files = info_files(self.config, self.root)
+
+        if cache_dir is None:
+            self.data = self.load_info_files(self.info_files)
+        else:
+            cache_file = cache_dir/"sites"/f"{site_id}.pickle"
+            key = (cache.file_key(*self.info_files), site_id, self.site_name)
+
+            if (data := cache.load(cache_file, key)) is None:
+                data = self.load_info_files(self.info_files)
+                cache.store(cache_file, key, data)
+
+            self.data = data
+
+        self.order
+        self.date_index
 
+    def load_info_files(self, info_files):
+        "returns a mapping of item IDs to Items, merged from the primary and extra info files"
         self.data = {}
 
-        primary_info_file = self.root/self.config["primary_info_file"]
+        primary_info_file, *extra_info_files = info_files
         with primary_info_file.open() as file:
             info = json.load(file)
 
@@ -37,8 +82,7 @@ class SiteInfo(collections.UserDict):
 
             self.data[item_id] = Item(item_id, item_data)
 
-        for extra_info_file in self.config.get("extra_info_files", []):
-            extra_info_file = self.root/extra_info_file
+        for extra_info_file in extra_info_files:
 
             with extra_info_file.open() as file:
                 info = json.load(file)
@@ -58,28 +102,174 @@ class SiteInfo(collections.UserDict):
                         self.data[item_id] = Item(item_id, item_data)
 
         for item_id, item in self.data.items():
-            item["internal_url"] = site_id + "/index.html" + "#" + item_id
-            item["site_id"] = site_id
+            item["internal_url"] = self.site_id + "/index.html" + "#" + item_id
+            item["site_id"] = self.site_id
             item["site_name"] = self.site_name
+            item.human_sort_key
+
+        return self.data
+
+    def __setitem__(self, item_id, item):
+        super().__setitem__(item_id, item)
+        self._order = self._positions = self._date_index = self._id_index = None
+
+    def __delitem__(self, item_id):
+        super().__delitem__(item_id)
+        self._order = self._positions = self._date_index = self._id_index = None
+
+    @property
+    def order(self):
+        "the site's item IDs in human sort order; only recomputed after items are added or removed"
+        if self._order is None:
+            self._order = sorted(self.data, key=lambda item_id: self.data[item_id].human_sort_key)
+        return self._order
+
+    @property
+    def positions(self):
+        "a mapping of item IDs to their index in self.order"
+        if self._positions is None:
+            self._positions = {item_id: i for i, item_id in enumerate(self.order)}
+        return self._positions
 
     def __iter__(self):
-        for item_id, _ in sorted(self.data.items(), key=lambda i: human_sort(i[1].get("sort_as", i[0]))):
-            yield item_id
+        return iter(self.order)
 
     def sort_item_ids(self, item_ids):
-        return sorted(item_ids, key=lambda item_id: self.data[item_id].get("sort_as", item_id))
+        return sorted(item_ids, key=self.positions.__getitem__)
+
+    @property
+    def date_index(self):
+        """ A mapping of size kinds ("duration", "images", ...) to the dated
+        items whose size has that kind, plus None to all dated items. Each
+        value is a list of (date, -n, item_id) tuples in date order, where n
+        is the item's position in the info files, so that of two items with
+        the same date the one listed first counts as the more recent. Only
+        recomputed after items are added or removed.
+        """
+        if self._date_index is None:
+            index = collections.defaultdict(list)
+
+            for n, (item_id, item) in enumerate(self.data.items()):
+                if "date" not in item:
+                    continue
+
+                entry = (item["date"], -n, item_id)
+                index[None] += [entry]
+                for kind in item.get("size", {}):
+                    index[kind] += [entry]
+
+            for entries in index.values():
+                entries.sort()
+
+            self._date_index = dict(index)
+
+        return self._date_index
+
+    def date_range(self, kind=None, start=None, end=None):
+        """ Returns the slice of self.date_index[kind] for items released
+        between start and end inclusive. Dates are compared as strings and
+        may be truncated, so an end of "2019" includes all of 2019.
+        """
+        entries = self.date_index.get(kind, [])
+        lo = 0 if start is None else bisect.bisect_left(entries, (start,))
+        hi = len(entries) if end is None else bisect.bisect_right(entries, (end + "\uffff", math.inf))
+        return entries[lo:hi]
+
+    def latest(self, kind=None, count=1, start=None, end=None):
+        "returns the IDs of the count most recent items with the given size kind (or any, if None), most recent first"
+        entries = self.date_range(kind, start, end)
+        return [item_id for _, _, item_id in reversed(entries[-count:])] if count > 0 else []
+
+    def earliest(self, kind=None, count=1, start=None, end=None):
+        "returns the IDs of the count least recent items with the given size kind (or any, if None), least recent first"
+        entries = self.date_range(kind, start, end)
+        return [item_id for _, _, item_id in entries[:count]]
+
+    def items_in_date_range(self, start=None, end=None, kind=None):
+        "returns the IDs of the items released between start and end inclusive, in date order"
+        return [item_id for _, _, item_id in self.date_range(kind, start, end)]
 
     def latest_video(self):
-        videos = [k for k, v in self.data.items() if "duration" in v["size"]]
-        videos = [k for k in videos if "date" in self.data[k]]
-        return max(videos, key=lambda k: self.data[k]["date"])
+        return self.latest("duration")[0]
 
     def latest_photo(self):
-        photos = [k for k, v in self.data.items() if "images" in v["size"]]
-        photos = [k for k in photos if "date" in self.data[k]]
-        return max(photos, key=lambda k: self.data[k]["date"])
+        return self.latest("images")[0]
+
+    def shortcuts(self):
+        "returns a list of (label, item ID) pairs for the shortcuts in the site's config"
+        shortcuts = []
+
+        for shortcut in self.config.get("shortcuts", []):
+            if isinstance(shortcut, str):
+                shortcut = self.SHORTCUTS[shortcut]
 
-class Item(collections.UserDict):
+            query = self.earliest if shortcut.get("earliest", False) else self.latest
+            item_ids = query(shortcut.get("kind"), shortcut.get("count", 1), shortcut.get("from"), shortcut.get("to"))
+
+            if len(item_ids) == 1:
+                shortcuts += [(shortcut["label"], item_ids[0])]
+            else:
+                shortcuts += [(f"{shortcut['label']} ({item_id})", item_id) for item_id in item_ids]
+
+        return shortcuts
+
+    def match_items(self, pattern):
+        "returns the IDs of the site's items matched by a models file pattern (a glob, possibly with {a,b} alternatives), in site order"
+        if self._id_index is None:
+            self._id_index = ItemIdIndex(self.order)
+        return self._id_index.query(pattern)
+
+    def summary(self):
+        "returns a mapping of item IDs to ItemSummaries for every item on the site"
+        return {
+                item_id: ItemSummary(item_id, item["internal_url"], item["site_name"])
+                for item_id, item in self.data.items()
+                }
+
+    def pages(self):
+        """ Splits the site's items into the pages described by the
+        "pagination" setting in its config, returning a list of SitePages
+        (each with its items in site order), or None if the site isn't
+        paginated.
+        """
+        if (pagination := self.config.get("pagination")) is None:
+            return None
+
+        if pagination["by"] == "year":
+            years = collections.defaultdict(list)
+            for item_id in self.order:
+                years[self.data[item_id].get("date", "")[:4]] += [item_id]
+
+            # undated items go last
+            return [
+                    SitePage(year or "Undated", f"{year or 'undated'}.html", item_ids)
+                    for year, item_ids in sorted(years.items(), key=lambda y: (y[0] == "", y[0]))
+                    ]
+
+        elif pagination["by"] == "count":
+            size = pagination["size"]
+            chunks = [self.order[i:i+size] for i in range(0, len(self.order), size)]
+
+        elif pagination["by"] == "sort_key":
+            # each boundary starts a new page at the first item that sorts at or after it
+            bounds = [human_sort(bound) for bound in pagination["ranges"]]
+            chunks = [[]]
+            for item_id in self.order:
+                while bounds and self.data[item_id].human_sort_key >= bounds[0]:
+                    bounds.pop(0)
+                    chunks += [[]]
+                chunks[-1] += [item_id]
+            chunks = [chunk for chunk in chunks if chunk]
+
+        else:
+            raise Exception(f"Unknown pagination {repr(pagination['by'])} for site {self.site_id}")
+
+        return [
+                SitePage(f"{chunk[0]} – {chunk[-1]}", f"page-{n}.html", chunk)
+                for n, chunk in enumerate(chunks, start=1)
+                ]
+
+class Item(SlottedMapping):
     mandatory_keys = tuple()
     optional_keys = {
             "description": "",
@@ -93,27 +283,55 @@ class Item(collections.UserDict):
             "price": None
             }
     all_keys = set(mandatory_keys + tuple(optional_keys.keys()))
+    # keys that SiteInfo adds to every item when it loads the site
+    derived_keys = ("internal_url", "site_id", "site_name")
 
+    KEYS = mandatory_keys + tuple(optional_keys) + derived_keys
+    __slots__ = SlottedMapping.slot_names(KEYS) + ("item_id", "_human_sort_key")
 
     def __init__(self, item_id, data):
         if not set(data.keys()).issubset(self.all_keys):
             raise Exception(f"{self.__class__.__name__} initialised with unknown keys {set(data.keys()) - self.all_keys}")
 
         self.item_id = item_id
-        self.data = data
 
-        if "size" in self.data:
-            size = self.data.pop("size")
-            self.data["size"] = {}
+        for key, value in data.items():
+            if key == "size":
+                value = {k: Size(v) for k, v in value.items()}
+            super().__setitem__(key, value)
+
+    def __setitem__(self, key, value):
+        self.check_writable()
+        super().__setitem__(key, value)
 
-            for key, value in size.items():
-                self.data["size"][key] = Size(value)
+    def __delitem__(self, key):
+        self.check_writable()
+        super().__delitem__(key)
+
+    def check_writable(self):
+        """ Items are read-only once their site has loaded them (which is when
+        their human_sort_key is computed), because the site's order, date
+        index and item ID index are built from them and would go stale.
+        """
+        if hasattr(self, "_human_sort_key"):
+            raise Exception(f"item {self.item_id} is read-only once its site has been loaded; change the site's info files instead")
 
     @property
     def sort_key(self):
-        return self.data.get("sort_as", self.item_id)
+        return self.get("sort_as", self.item_id)
+
+    @property
+    def human_sort_key(self):
+        "human_sort(self.sort_key), computed once"
+        try:
+            return self._human_sort_key
+        except AttributeError:
+            self._human_sort_key = human_sort(self.sort_key)
+            return self._human_sort_key
 
 class Size:
+    __slots__ = ("data",)
+
     def __init__(self, data):
         self.data = data
 
@@ -1,29 +1,41 @@
 #!/usr/bin/env python3
 
 import collections
+import concurrent.futures
 import datetime
 import itertools
 import json
+import os
 import pathlib
 import random
 import string
 import subprocess
+import time
 import urllib
 
 import click
 import flask
 import markdown
+import markupsafe
 
-from model import ModelInfo, SiteModelInfo, UserDictJSONEncoder, pattern_filter
-from item import SiteInfo
-from relation import RelationInfo
+from atomic_write import atomic_write, atomic_write_chunks
+from corpus import Corpus
+from images import ModelImages
+from item import info_files
+from manifest import Manifest
+from model import Model, ModelInfo, UserDictJSONEncoder
+from search import NameSearchIndex
 
-from human_sort import human_sort
-
-global_config = pathlib.Path("/Users/benzlock/Desktop/mhg1o/canon/config.json")
+global_config = pathlib.Path(os.environ.get("CANON_CONFIG", "/Users/benzlock/Desktop/mhg1o/canon/config.json"))
 root = global_config.parent
 global_config = json.loads(global_config.read_text())
 
+corpus = Corpus(root, global_config)
+
+cache_dir = corpus.cache_dir
+
+model_images = ModelImages(root/global_config["static_files"]/"model-images")
+
 app = flask.Flask("MH's index", template_folder=root/"templates")
 app.jinja_env.trim_blocks = True
 app.jinja_env.lstrip_blocks = True
@@ -34,64 +46,52 @@ def markdown_filter(md):
 
 PRIVATE_WEBSITES = {"vk.com", "facebook.com"}
 
-def load_site_config(config_location):
-    if str(config_location).startswith("$extra_configs/"):
-        return global_config["extra_configs"][config_location.removeprefix("$extra_configs/")]
-    else:
-        with (root/config_location).open() as file:
-            return json.load(file)
-
-def load_site(config_location):
-    with config_location.open() as file:
-        config = json.load(file)
-        site_root = config_location.parent
-
-    for _, site_configs in global_config["families"].items():
-        for site_id, _config_location in site_configs.items():
-            if config_location.resolve() == (root/_config_location).resolve():
-                return SiteInfo(site_id, config, site_root)
-
 def model_image_func(depth):
     def model_image(model_id):
-        if (root/global_config["static_files"]/"model-images"/f"{model_id}.jpg").exists():
+        if model_id in model_images:
             return (depth * "../") + f"static/model-images/{model_id}.jpg"
         else:
             return (depth * "../") + f"static/default-model-img.jpg"
 
     return model_image
 
+def model_image_attrs_func(depth):
+    "returns a function that gives the width, height, srcset and sizes attributes for a model's <img>, from the image manifest"
+    def model_image_attrs(model_id):
+        variants = model_images.variants(model_id)
+        if not variants:
+            return markupsafe.Markup("")
+
+        full = max(variants, key=lambda v: v["width"])
+        srcset = ", ".join(
+                (depth * "../") + f"static/model-images/{v['file']} {v['width']}w"
+                for v in sorted(variants, key=lambda v: v["width"])
+                if v["format"] == "webp"
+                )
+
+        return markupsafe.Markup(' width="{}" height="{}" srcset="{}" sizes="{}px"').format(
+                full["width"], full["height"], srcset, full["width"]
+                )
+
+    return model_image_attrs
+
 def load_site_configs():
     "returns a mapping of site family names to lists of site configs"
     families = collections.defaultdict(dict)
 
     for family, site_configs in global_config["families"].items():
-        for site_id, site_config in site_configs.items():
-            families[family][site_id] = load_site_config(site_config)
+        for site_id in site_configs:
+            families[family][site_id] = corpus.site_config(site_id)
 
     return families
 
-def load_all_sites():
-    "returns a mapping of site IDs to Site objects"
-    sites = {}
-
-    for family, site_configs in global_config["families"].items():
-        for site_id, site_config_file in site_configs.items():
-            site_config = load_site_config(site_config_file)
-
-            if "wip" in site_config.get("tags", []):
-                continue
-            else:
-                site = load_site(root/site_config_file)
-
-            sites[site_id] = site
-    return sites
-
 def model_page(model, appearances, private):
     return flask.render_template(
             "model.html",
             model=model,
             appearances=appearances,
             get_model_image=model_image_func(depth=2),
+            get_model_image_attrs=model_image_attrs_func(depth=2),
             private=private
             )
 
@@ -113,35 +113,51 @@ def models_page(family_models, all_models, private_models):
             family_models=family_models,
             all_models=all_models,
             model_image=model_image,
+            model_image_attrs=model_image_attrs_func(2),
             private_models=private_models
             )
 
-def site_page(site, notes):
+def item_pages(pages):
+    "returns a mapping of item IDs to the file of the page (a SitePage) they are on"
+    return {item_id: page.file for page in pages for item_id in page.item_ids}
 
-    IMAGE_EXTENSIONS = {".gif", ".jpg", ".jpeg", ".JPG", ".png"}
+def site_page(site, notes, stream=False, pages=None, page=None):
+    """ Renders the site's index page, or if stream is true, returns an
+    iterator over pieces of it as they are rendered. For a paginated site
+    (pages is the list of its SitePages), this is the table of contents if
+    page is None, and otherwise the given page.
+    """
 
-    ri = RelationInfo(root/global_config["relations_dir"], load_all_sites())
+    IMAGE_EXTENSIONS = {".gif", ".jpg", ".jpeg", ".JPG", ".png"}
 
-    mi = ModelInfo(root/global_config["models_file"])
-
-    if "models_file" in site.config:
-        models_file = site.root/site.config["models_file"]
-    else:
-        models_file = None
-    models = SiteModelInfo(models_file, mi, tuple(site.keys()))
+    ri = corpus.relations
+    models = corpus.site_model_info(site.site_id)
 
     def is_image(url):
         url = urllib.parse.urlparse(url)
         return any(url.path.endswith(ext) for ext in IMAGE_EXTENSIONS)
 
-    return flask.render_template(
+    if pages is None:
+        items = site.items()
+    elif page is None:
+        items = []
+    else:
+        items = [(item_id, site[item_id]) for item_id in page.item_ids]
+
+    render = flask.stream_template if stream else flask.render_template
+
+    return render(
             "site.html",
             site=site,
+            items=items,
+            pages=pages,
+            page=page,
+            item_pages=item_pages(pages) if pages is not None else {},
             notes=notes,
             is_image=is_image,
             generated=datetime.datetime.now(),
             data_updated=site.config.get("data_updated", None),
-            shortcuts=site.config.get("shortcuts", []),
+            shortcuts=site.shortcuts(),
             relations=ri,
             models=models
             )
@@ -149,6 +165,188 @@ def site_page(site, notes):
 def base_page(families):
     return flask.render_template("index.html", families=families)
 
+def model_appearances(model):
+    "returns a mapping of site names to the items on that site that the model appears in"
+    return {
+            corpus.site(site_id).site_name: items
+            for site_id, items in corpus.model_appearances.get(model.model_id, {}).items()
+            }
+
+def load_private_models():
+    with (root/global_config["private_models_file"]).open() as file:
+        return set(json.load(file))
+
+def load_manifest():
+    return Manifest(cache_dir/"manifest.json", root)
+
+def template_files(*names):
+    return [root/"templates"/name for name in ("base.html", *names)]
+
+def site_page_dest(site_id):
+    return root/global_config["index_root"]/"sites"/site_id/"index.html"
+
+def site_page_files(site_id):
+    "returns every file that write_site_page writes for a site, its index page first"
+    dest = site_page_dest(site_id)
+    if (pages := corpus.site(site_id).pages()) is None:
+        return [dest]
+    return [dest, *(dest.parent/page.file for page in pages), dest.parent/"pages.js"]
+
+def record_site_page(manifest, site_id, inputs):
+    "records the files written for a site in the manifest, and removes any that an earlier build wrote but this one didn't (e.g. because the site's pagination changed)"
+    files = site_page_files(site_id)
+    for stale in manifest.stale_files(files[0], files):
+        stale.unlink(missing_ok=True)
+    manifest.record(files[0], inputs, files)
+
+def site_page_inputs(manifest, site_id):
+    "returns the digests of everything the index page for a site is built from, without loading the site"
+    config = corpus.site_config(site_id)
+    site_root = corpus.site_root(site_id)
+
+    files = info_files(config, site_root)
+    files += sorted(corpus.relations.site_files[site_id])
+    files += template_files("site.html")
+
+    model_names = {}
+    if "models_file" in config:
+        files += [site_root/config["models_file"]]
+        with (site_root/config["models_file"]).open() as file:
+            for model_id in json.load(file):
+                model_names[model_id] = corpus.model_info[model_id].display_name
+
+    values = {
+            "config": config,
+            "related site configs": {s: corpus.site_config(s) for s in sorted(corpus.relations.linked_sites[site_id])},
+            "model names": model_names,
+            }
+
+    return manifest.inputs(files, values)
+
+def model_page_dest(model_id):
+    return root/global_config["index_root"]/"models"/(model_id + ".html")
+
+def model_page_inputs(manifest, model_id, private):
+    "returns the digests of everything the page for a model is built from"
+    model = corpus.model_info[model_id]
+
+    values = {
+            "model": model,
+            "private": private,
+            "appearances": model_appearances(model),
+            "image": model_image_func(depth=2)(model_id),
+            "image_variants": model_images.variants(model_id),
+            }
+
+    return manifest.inputs(template_files("model.html"), values)
+
+def write_site_page(site_id):
+    site = corpus.site(site_id)
+    dest = site_page_dest(site.site_id)
+
+    if not dest.parent.exists():
+        dest.parent.mkdir(parents=True)
+
+    pages = site.pages()
+
+    # the biggest sites' pages are large, so write them out as they are rendered
+    with app.app_context():
+        atomic_write_chunks(dest, site_page(site, [], stream=True, pages=pages))
+        for page in pages or []:
+            atomic_write_chunks(dest.parent/page.file, site_page(site, [], stream=True, pages=pages, page=page))
+
+    if pages is not None:
+        # links to index.html#<item ID> are sent on to the right page with this
+        js = json.dumps(item_pages(pages), ensure_ascii=False, separators=(",", ":"))
+        atomic_write(dest.parent/"pages.js", f"var ITEM_PAGES = {js};\n")
+
+    return dest
+
+def write_model_page(model_id, private):
+    model = corpus.model_info[model_id]
+    appearances = model_appearances(model)
+
+    links = []
+    for link in model["links"]:
+        if not any(p in link for p in PRIVATE_WEBSITES):
+            links += [link]
+    # the corpus's models are shared with other pages, so render from a copy
+    model = Model(model.model_id, dict(model, links=links))
+
+    with app.app_context():
+        page = model_page(model, appearances, private)
+    dest = model_page_dest(model.model_id)
+    dest.write_text(page)
+    return dest
+
+def write_models_index():
+    mi = corpus.model_info
+
+    family_models = collections.defaultdict(set)
+    private_models = load_private_models()
+
+    for model_id, appearances in corpus.model_appearances.items():
+        for site_id in appearances:
+            family_models[corpus.site_families[site_id]].add(mi[model_id])
+
+    # list the families in the order of the master config
+    family_models = collections.defaultdict(set, {
+            family: family_models[family]
+            for family in global_config["families"]
+            if family in family_models
+            })
+
+    present = set.union(*family_models.values())
+    for model in mi.values():
+        if model not in present:
+            family_models[None].add(model)
+
+    with app.app_context():
+        page = models_page(family_models, tuple(mi.values()), private_models)
+
+    dest = root/global_config["index_root"]/"models"/"index.html"
+    dest.write_text(page)
+
+    # the search box on the models page runs entirely in the browser from this index
+    search_index = NameSearchIndex(mi).to_json(model_image_func(2))
+    js = json.dumps(search_index, ensure_ascii=False, separators=(",", ":"))
+    (dest.parent/"search-index.js").write_text(f"var SEARCH_INDEX = {js};\n")
+
+    return dest
+
+def write_base_page():
+    families = load_site_configs()
+
+    for family, site_configs in families.items():
+        for site_id, site_config in site_configs.items():
+            if "wip" not in site_config.get("tags", []) and not (root/"html"/"sites"/site_id/"index.html").exists():
+                raise Exception(f"index for {site_id} seems to have moved: its index page is not in the expected location")
+
+    with app.app_context():
+        page = base_page(families)
+
+    dest = root/global_config["index_root"]/"index.html"
+    dest.write_text(page)
+    return dest
+
+def load_corpus():
+    """ Loads every site with its models, the relations and the model
+    appearances. build-all does this before starting its workers, which warms
+    the caches, and then in each worker: a forked worker already has it all,
+    and a spawned one (the default on macOS and Windows) reloads it from the
+    caches rather than from the info files.
+    """
+    for site_id in corpus.site_ids:
+        corpus.site_model_info(site_id)
+    corpus.relations
+    corpus.model_appearances
+
+def timed(func, *args):
+    "calls func with args and returns how long it took in seconds"
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
 if __name__ == "__main__":
 
     @click.group()
@@ -158,22 +356,10 @@ if __name__ == "__main__":
     @cli.command()
     @click.argument("models", nargs=-1)
     @click.option("--private", is_flag=True)
-    def model(models, private):
-        mi = ModelInfo(root/global_config["models_file"])
-        sites = load_all_sites()
-
-        site_model_infos = {}
-        for site_id in sites:
-            if site_id not in site_model_infos:
-                if "models_file" in sites[site_id].config:
-                    models_file = sites[site_id].root/sites[site_id].config["models_file"]
-                else:
-                    models_file = None
-
-                site_model_infos[site_id] = SiteModelInfo(models_file, mi, tuple(sites[site_id].keys()))
-
-        site_ids = [list(sites.keys()) for _, sites in global_config["families"].items()]
-        site_ids = sum(site_ids, start=[])
+    @click.option("--incremental", is_flag=True, help="only render pages whose inputs have changed")
+    def model(models, private, incremental):
+        mi = corpus.model_info
+        manifest = load_manifest()
 
         if models:
             model_ids =  [mi.fuzzy_get_model_id(query) for query in models]
@@ -181,8 +367,7 @@ if __name__ == "__main__":
         else:
             model_list = list(mi.values())
 
-        with (root/global_config["private_models_file"]).open() as file:
-            private_models = set(json.load(file))
+        private_models = load_private_models()
         if private:
             private_models = private_models | set(m.model_id for m in model_list)
         else:
@@ -190,36 +375,22 @@ if __name__ == "__main__":
         with (root/global_config["private_models_file"]).open("w") as file:
             json.dump(sorted(private_models), file, indent=4)
 
-        ItemLink = collections.namedtuple("ItemLink", ("item_id", "sort_key", "internal_url", "name"))
         for model in model_list:
-            appearances = {}
-
-            for site_id, site in sites.items():
-                if model.model_id in site_model_infos[site_id].models:
-                    items = []
-                    for item_id in site_model_infos[site_id].models[model.model_id]:
-                        url = "../sites/" + site[item_id]["internal_url"]
-                        item_link = ItemLink(item_id, site[item_id].sort_key, url, site[item_id].get("name", None))
-                        items += [item_link]
-                    appearances[site.site_name] = sorted(items, key=lambda i: human_sort(i.sort_key))
-
-            links = []
-            for link in model["links"]:
-                if not any(p in link for p in PRIVATE_WEBSITES):
-                    links += [link]
-            model["links"] = links
-
-            with app.app_context():
-                page = model_page(model, appearances, private)
-            dest = (root/global_config["index_root"]/"models"/(model.model_id + ".html"))
-            dest.write_text(page)
+            inputs = model_page_inputs(manifest, model.model_id, private)
+            if incremental and manifest.is_fresh(model_page_dest(model.model_id), inputs):
+                continue
+
+            dest = write_model_page(model.model_id, private)
+            manifest.record(dest, inputs)
             subprocess.run("pbcopy", input=bytes(dest.as_uri(), "utf-8"))
             print(model.model_id)
 
+        manifest.save()
+
     @cli.command()
     @click.argument("model_name")
     def edit_model(model_name):
-        with ModelInfo(root/global_config["models_file"]) as mi:
+        with ModelInfo(root/global_config["models_file"], global_config.get("models_journal_size")) as mi:
             model_id = mi.fuzzy_get_model_id(model_name)
 
             data = json.dumps(mi[model_id], cls=UserDictJSONEncoder, ensure_ascii=False, indent=4)
@@ -232,7 +403,7 @@ if __name__ == "__main__":
     @cli.command()
     @click.argument("model_name")
     def edit_model_bio(model_name):
-        with ModelInfo(root/global_config["models_file"]) as mi:
+        with ModelInfo(root/global_config["models_file"], global_config.get("models_journal_size")) as mi:
             model_id = mi.fuzzy_get_model_id(model_name)
             biography = mi[model_id]["biography"]
 
@@ -241,71 +412,77 @@ if __name__ == "__main__":
 
     @cli.command()
     def models_base():
-        mi = ModelInfo(root/global_config["models_file"])
-
-        sites = load_all_sites()
-        family_models = collections.defaultdict(set)
-        with (root/global_config["private_models_file"]).open() as file:
-            private_models = set(json.load(file))
-
-        for family, site_ids in global_config["families"].items():
-            for site_id in site_ids:
-
-                if site_id not in sites:
-                    continue
-
-                if "models_file" in sites[site_id].config:
-                    models_file = sites[site_id].root/sites[site_id].config["models_file"]
-                else:
-                    models_file = None
-
-                site_model_info = SiteModelInfo(models_file, mi, tuple(sites[site_id].keys()))
-
-                for model_id in site_model_info.models:
-                    family_models[family].add(mi[model_id])
-
-        present = set.union(*family_models.values())
-        for model in mi.values():
-            if model not in present:
-                family_models[None].add(model)
-
-        with app.app_context():
-            page = models_page(family_models, tuple(mi.values()), private_models)
-
-        (root/global_config["index_root"]/"models"/"index.html").write_text(page)
+        write_models_index()
 
     @cli.command()
     @click.argument("configs", nargs=-1, type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path))
-    def site(configs):
+    @click.option("--incremental", is_flag=True, help="only render pages whose inputs have changed")
+    def site(configs, incremental):
+        manifest = load_manifest()
 
         for config in configs:
-            site = load_site(config)
-
-            with app.app_context():
-                page = site_page(site, [])
-
-            dest = root/global_config["index_root"]/"sites"/site.site_id/"index.html"
-
-            if not dest.parent.exists():
-                dest.parent.mkdir(parents=True)
+            site_id = corpus.site_id_for_config(config)
+            inputs = site_page_inputs(manifest, site_id)
+            if incremental and manifest.is_fresh(site_page_dest(site_id), inputs):
+                continue
 
-            dest.write_text(page)
+            dest = write_site_page(site_id)
+            record_site_page(manifest, site_id, inputs)
             subprocess.run("pbcopy", input=bytes(dest.as_uri(), "utf-8"))
 
+        manifest.save()
+
     @cli.command()
     def base():
+        write_base_page()
+
+    @cli.command("build-all")
+    @click.option("--jobs", "-j", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    @click.option("--incremental", is_flag=True, help="only render pages whose inputs have changed")
+    def build_all(jobs, incremental):
+        start = time.perf_counter()
+
+        manifest = load_manifest()
+        private_models = load_private_models()
+
+        # (description, destination, inputs, render function, arguments) for every page
+        pages = []
+        for site_id in corpus.site_ids:
+            inputs = site_page_inputs(manifest, site_id)
+            pages += [(f"site {site_id}", site_page_dest(site_id), inputs, write_site_page, (site_id,))]
+        for model_id in corpus.model_info:
+            private = model_id in private_models
+            inputs = model_page_inputs(manifest, model_id, private)
+            pages += [(f"model {model_id}", model_page_dest(model_id), inputs, write_model_page, (model_id, private))]
+
+        if incremental:
+            pages = [page for page in pages if not manifest.is_fresh(page[1], page[2])]
+
+        load_corpus()
+
+        timings = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=load_corpus) as executor:
+            futures = {}
+            for description, dest, inputs, render, args in pages:
+                futures[executor.submit(timed, render, *args)] = (description, dest, inputs, render, args)
+
+            for future in concurrent.futures.as_completed(futures):
+                description, dest, inputs, render, args = futures[future]
+                timings[description] = future.result()
+                if render is write_site_page:
+                    record_site_page(manifest, *args, inputs)
+                else:
+                    manifest.record(dest, inputs)
 
-        families = load_site_configs()
-
-        for family, site_configs in families.items():
-            for site_id, site_config in site_configs.items():
-                if "wip" not in site_config.get("tags", []) and not (root/"html"/"sites"/site_id/"index.html").exists():
-                    raise Exception(f"index for {site_id} seems to have moved: its index page is not in the expected location")
+        manifest.save()
 
-        with app.app_context():
-            page = base_page(families)
+        timings["models index"] = timed(write_models_index)
+        timings["base"] = timed(write_base_page)
 
-        (root/global_config["index_root"]/"index.html").write_text(page)
+        slowest = sorted(timings.items(), key=lambda t: t[1], reverse=True)
+        for page, seconds in slowest[:10]:
+            print(f"{seconds:8.3f}s  {page}")
+        print(f"rendered {len(timings)} pages ({sum(timings.values()):.3f}s of rendering) in {time.perf_counter() - start:.3f}s")
 
     @cli.command()
     @click.argument("site_id", required=True)
@@ -314,13 +491,10 @@ if __name__ == "__main__":
     @click.option("--display-name")
     @click.option("--credited-as")
     def set_model(site_id, patterns, model_query, display_name, credited_as):
-        mi = ModelInfo(root/global_config["models_file"])
+        mi = corpus.model_info
         model_id = mi.fuzzy_get_model_id(model_query)
 
-        for family, site_configs in global_config["families"].items():
-            if site_id in site_configs:
-                site = load_site(root/site_configs[site_id])
-                break
+        site = corpus.site(site_id)
 
         if "models_file" not in site.config:
             raise Exception(f"site {site_id} has no model file")
@@ -331,7 +505,7 @@ if __name__ == "__main__":
         # TODO do not split on commas inside { }
         patterns = patterns.split(",")
         for pattern in patterns:
-            if not tuple(pattern_filter(site, pattern)):
+            if not site.match_items(pattern):
                 raise Exception(f"{pattern} matches nothing")
 
             if model_id in info:
@@ -380,7 +554,7 @@ if __name__ == "__main__":
         id_chars = string.ascii_letters + string.digits
         gen_model_id = lambda: "".join(random.choices(id_chars, k=8))
 
-        with ModelInfo(root/global_config["models_file"]) as mi:
+        with ModelInfo(root/global_config["models_file"], global_config.get("models_journal_size")) as mi:
             while (model_id := gen_model_id()) in mi:
                 pass
 
@@ -399,21 +573,67 @@ if __name__ == "__main__":
     @click.argument("model_query")
     @click.argument("image", type=click.Path(exists=True, dir_okay=False))
     def prep_model_img(model_query, image):
-        mi = ModelInfo(root/global_config["models_file"])
+        mi = corpus.model_info
         model_id = mi.fuzzy_get_model_id(model_query)
 
-        r = subprocess.run(
-                [
-                    "magick", "convert", image,
-                    "-resize", "x300",
-                    "-gravity", "center",
-                    "-background", "white",
-                    "-extent", "200x300",
-                    "-"
-                    ],
-                stdout=subprocess.PIPE
-                )
-        (root/global_config["static_files"]/"model-images"/(model_id+".jpg")).write_bytes(r.stdout)
+        model_images.prepare(model_id, image)
+
+    @cli.command()
+    @click.argument("source", type=click.Path(exists=True, path_type=pathlib.Path))
+    @click.option("--jobs", "-j", default=4, help="number of images to convert at once")
+    @click.option("--force", is_flag=True, help="convert images even if they haven't changed")
+    def prep_model_imgs(source, jobs, force):
+        """ Prepare the images for many models at once. SOURCE is either a
+        directory of images, each named after the model it is for (e.g.
+        "Kate.png"), or a JSON file mapping model queries to image files
+        (relative to the JSON file).
+        """
+        IMAGE_EXTENSIONS = {".gif", ".jpg", ".jpeg", ".png", ".webp"}
+
+        if source.is_dir():
+            images = {path.stem: path for path in sorted(source.iterdir()) if path.suffix.lower() in IMAGE_EXTENSIONS}
+        else:
+            images = {query: source.parent/image for query, image in json.loads(source.read_text()).items()}
+
+        mi = corpus.model_info
+        failures = {}
+
+        jobs_by_model = {}
+        for query, image in images.items():
+            try:
+                model_id = mi.fuzzy_get_model_id(query)
+            except Exception as e:
+                failures[query] = e
+                continue
+
+            if model_id in jobs_by_model:
+                failures[query] = Exception(f"{repr(query)} and {repr(jobs_by_model[model_id][0])} are both model {model_id}")
+            elif not image.is_file():
+                failures[query] = Exception(f"no such image {image}")
+            else:
+                jobs_by_model[model_id] = (query, image)
+
+        converted = skipped = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                    pool.submit(model_images.prepare, model_id, image, force): (model_id, query)
+                    for model_id, (query, image) in jobs_by_model.items()
+                    }
+
+            for future in concurrent.futures.as_completed(futures):
+                model_id, query = futures[future]
+                try:
+                    if future.result():
+                        converted += 1
+                        print(f"{model_id} ({query})")
+                    else:
+                        skipped += 1
+                except Exception as e:
+                    failures[query] = e
+
+        print(f"converted {converted}, skipped {skipped} unchanged, {len(failures)} failed")
+        for query, e in failures.items():
+            print(f"  {query}: {e}")
 
     cli()
 
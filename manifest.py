@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import pathlib
+
+from atomic_write import atomic_write
+from model import UserDictJSONEncoder
+
+class Manifest:
+    "records the inputs that each generated page was built from, so that pages whose inputs haven't changed can be skipped"
+
+    def __init__(self, manifest_file, root):
+        if isinstance(manifest_file, str):
+            manifest_file = pathlib.Path(manifest_file)
+
+        self.manifest_file = manifest_file
+        self.root = root
+
+        if self.manifest_file.exists():
+            with self.manifest_file.open() as file:
+                manifest = json.load(file)
+        else:
+            manifest = {}
+
+        # relative path -> [mtime_ns, size, sha1], so unchanged files are not re-hashed
+        self.files = manifest.get("files", {})
+        # relative path of a page -> mapping of input names to digests
+        self.pages = manifest.get("pages", {})
+        # relative path of a page -> relative paths of every file written along with it (including the page)
+        self.outputs = manifest.get("outputs", {})
+
+    def relative(self, path):
+        path = pathlib.Path(path)
+        try:
+            return str(path.resolve().relative_to(self.root.resolve()))
+        except ValueError:
+            return str(path.resolve())
+
+    def file_digest(self, path):
+        path = pathlib.Path(path)
+        key = self.relative(path)
+
+        if not path.exists():
+            self.files.pop(key, None)
+            return None
+
+        stat = path.stat()
+        if (cached := self.files.get(key)) and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return cached[2]
+
+        digest = hashlib.sha1(path.read_bytes()).hexdigest()
+        self.files[key] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def value_digest(self, value):
+        js = json.dumps(value, cls=UserDictJSONEncoder, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(js.encode("utf-8")).hexdigest()
+
+    def inputs(self, files=(), values=None):
+        "returns a mapping of input names to digests for the given input files and JSON-serialisable values"
+        inputs = {}
+
+        for file in files:
+            inputs["file:" + self.relative(file)] = self.file_digest(file)
+
+        for name, value in (values or {}).items():
+            inputs["value:" + name] = self.value_digest(value)
+
+        return inputs
+
+    def is_fresh(self, page, inputs):
+        "returns whether the page and every file recorded as written along with it exist, and its inputs haven't changed"
+        page = self.relative(page)
+        return (
+                self.pages.get(page) == inputs
+                and all((self.root/f).exists() for f in self.outputs.get(page, [page]))
+                )
+
+    def stale_files(self, page, files):
+        "returns the files recorded as written along with the page that aren't among files"
+        files = {self.relative(f) for f in files}
+        return [self.root/f for f in self.outputs.get(self.relative(page), []) if f not in files]
+
+    def record(self, page, inputs, files=None):
+        "records the page's inputs and, if the page is written along with other files, every file written (including the page)"
+        page = self.relative(page)
+        self.pages[page] = inputs
+        if files is None:
+            self.outputs.pop(page, None)
+        else:
+            self.outputs[page] = [self.relative(f) for f in files]
+
+    def save(self):
+        if not self.manifest_file.parent.exists():
+            self.manifest_file.parent.mkdir(parents=True)
+
+        js = json.dumps({"files": self.files, "pages": self.pages, "outputs": self.outputs}, indent=4, sort_keys=True)
+        atomic_write(self.manifest_file, js)
@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
 
+import bisect
 import collections
+import collections.abc
 import fnmatch
+import functools
 import itertools
 import json
 import math
+import os
 import pathlib
+import re
+import sys
 
-from levenshtein import levenshtein
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from atomic_write import atomic_write
+from slotted import SlottedMapping
 
 def preprocess_pattern(pat):
     out = [""]
@@ -31,14 +43,107 @@ def preprocess_pattern(pat):
 
     return out
 
+MAGIC_CHARS = re.compile(r"[*?[]")
+
+class CompiledPattern:
+    "a model-file pattern that has been brace-expanded and translated once"
+
+    def __init__(self, pat):
+        self.pattern = pat
+        self.alternatives = tuple(preprocess_pattern(pat))
+
+        magic = [MAGIC_CHARS.search(p) for p in self.alternatives]
+        # the literal part at the start of each alternative, which every name it matches starts with
+        self.prefixes = tuple(p[:m.start()] if m else p for p, m in zip(self.alternatives, magic))
+
+        if not any(magic):
+            self.literals = frozenset(self.alternatives)
+            self.match = self.literals.__contains__
+        elif len(self.alternatives) == 1 and self.alternatives[0].endswith("*") and magic[0].start() == len(self.alternatives[0]) - 1:
+            self.prefix = self.alternatives[0][:-1]
+            self.match = self.match_prefix
+        else:
+            self.regex = re.compile("|".join(fnmatch.translate(p) for p in self.alternatives))
+            self.match = self.match_regex
+
+    def match_prefix(self, name):
+        return name.startswith(self.prefix)
+
+    def match_regex(self, name):
+        return self.regex.match(name) is not None
+
+    def filter(self, names):
+        return filter(self.match, names)
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pat):
+    return CompiledPattern(pat)
+
+class ItemIdIndex:
+    """ A sorted index of item IDs that answers pattern queries by jumping to
+    the IDs that start with the literal prefix of each of the pattern's
+    alternatives, and only testing those.
+    """
+
+    def __init__(self, item_ids):
+        self.item_ids = tuple(item_ids)
+        self.positions = {item_id: n for n, item_id in enumerate(self.item_ids)}
+        self.sorted_ids = sorted(self.item_ids)
+
+    def with_prefix(self, prefix):
+        "returns the item IDs that start with prefix"
+        start = bisect.bisect_left(self.sorted_ids, prefix)
+
+        # the IDs with the prefix end before the first string greater than every one of them: the prefix
+        # with its last character incremented (a character that can't be incremented is dropped first)
+        upper = prefix.rstrip(chr(sys.maxunicode))
+        if upper:
+            end = bisect.bisect_left(self.sorted_ids, upper[:-1] + chr(ord(upper[-1]) + 1), start)
+        else:
+            end = len(self.sorted_ids)
+
+        return self.sorted_ids[start:end]
+
+    def query(self, pat):
+        "returns the item IDs matched by pat, in the order they were given in"
+        pattern = compile_pattern(pat)
+
+        candidates = set()
+        for prefix in pattern.prefixes:
+            candidates.update(self.with_prefix(prefix))
+
+        return sorted(filter(pattern.match, candidates), key=self.positions.__getitem__)
+
 def pattern_match(name, pat):
-    patterns = preprocess_pattern(pat)
-    return any(fnmatch.fnmatch(name, p) for p in patterns)
+    return compile_pattern(pat).match(name)
 
 def pattern_filter(names, pat):
-    return filter(lambda name: pattern_match(name, pat), names)
+    return compile_pattern(pat).filter(names)
+
+def substring_distance(pattern, text, limit=None):
+    """ Returns the smallest Levenshtein distance between pattern and any
+    substring of text, in a single O(len(pattern) * len(text)) pass.
+
+    Row i of the table holds, for each position in text, the cost of
+    matching pattern[:i] against the best substring ending there; row 0 is
+    all zeros because a match may start anywhere. Row minima never decrease,
+    so if limit is given and a row's minimum exceeds it, that minimum is
+    returned straight away as a lower bound.
+    """
+    row = [0] * (len(text) + 1)
 
-def min_substring_distance(a, b, ignore_case=True):
+    for i, p in enumerate(pattern, start=1):
+        previous, row = row, [i]
+        for j, t in enumerate(text, start=1):
+            row += [min(previous[j-1] + (p != t), previous[j] + 1, row[j-1] + 1)]
+
+        if limit is not None and (m := min(row)) > limit:
+            return m
+
+    return min(row)
+
+def min_substring_distance(a, b, ignore_case=True, limit=None):
+    "returns the smallest edit distance between the shorter of a and b (a, if they are equally long) and any substring of the other"
     if len(a) == len(b):
         sml = a
         lng = b
@@ -50,16 +155,144 @@ def min_substring_distance(a, b, ignore_case=True):
         sml = sml.lower()
         lng = lng.lower()
 
-    d = levenshtein(sml, lng[:len(sml)])
+    return substring_distance(sml, lng, limit)
 
-    for i in range(len(lng) - len(sml)):
-        d = min(d, levenshtein(sml, lng[i:i+len(sml)]))
-    return d
+def min_substring_distances(names, query, ignore_case=True):
+    """ Returns [min_substring_distance(name, query) for name in names],
+    scoring all of the names at once with NumPy if it is available.
 
-class ModelInfo(collections.UserDict):
+    The names are split into those that are longer than the query (which is
+    then the pattern) and the rest (which are the patterns). Each group is
+    padded into one array, and the DP table is filled one pattern row at a
+    time for the whole group. Within a row, the left-to-right insertion
+    chain D[j] = min(X[j], D[j-1] + 1) is resolved with a cumulative minimum
+    of X[j] - j.
+    """
+    if numpy is None:
+        return [min_substring_distance(name, query, ignore_case) for name in names]
 
-    def __init__(self, info_file):
+    if ignore_case:
+        query = query.lower()
+        names = [name.lower() for name in names]
+
+    def codes(strings, width):
+        array = numpy.full((len(strings), width), -1, dtype=numpy.int64)
+        for k, s in enumerate(strings):
+            array[k, :len(s)] = [ord(c) for c in s]
+        return array
+
+    def next_row(i, previous, mismatch):
+        x = numpy.empty_like(previous)
+        x[:, 0] = i
+        x[:, 1:] = numpy.minimum(previous[:, :-1] + mismatch, previous[:, 1:] + 1)
+        offsets = numpy.arange(x.shape[1])
+        return numpy.minimum.accumulate(x - offsets, axis=1) + offsets
+
+    distances = [0] * len(names)
+    longer = [k for k, name in enumerate(names) if len(name) > len(query)]
+    shorter = [k for k, name in enumerate(names) if len(name) <= len(query)]
+
+    if longer:
+        # the query is the pattern and the names are the texts
+        lengths = numpy.array([len(names[k]) for k in longer])
+        texts = codes([names[k] for k in longer], lengths.max())
+
+        row = numpy.zeros((len(longer), texts.shape[1] + 1), dtype=numpy.int64)
+        for i, p in enumerate(query, start=1):
+            row = next_row(i, row, texts != ord(p))
+
+        # columns past the end of a name are padding
+        row[numpy.arange(row.shape[1]) > lengths[:, None]] = numpy.iinfo(numpy.int64).max
+        for k, d in zip(longer, row.min(axis=1)):
+            distances[k] = int(d)
+
+    if shorter:
+        # the names are the patterns and the query is the text
+        lengths = [len(names[k]) for k in shorter]
+        patterns = codes([names[k] for k in shorter], max(lengths))
+        text = codes([query], len(query))
+
+        row = numpy.zeros((len(shorter), len(query) + 1), dtype=numpy.int64)
+        for i in range(1, max(lengths) + 1):
+            row = next_row(i, row, patterns[:, i-1:i] != text)
+            for n, length in enumerate(lengths):
+                if length == i:
+                    distances[shorter[n]] = int(row[n].min())
+
+    return distances
+
+def bounded_levenshtein(a, b, limit):
+    """ Returns the Levenshtein distance between a and b if it is at most
+    limit, and otherwise some number greater than limit. The minimum of a
+    row of the DP table never decreases from one row to the next, so the
+    computation stops as soon as a row's minimum exceeds limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return abs(len(a) - len(b))
+
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        previous, row = row, [i]
+        for j, cb in enumerate(b, start=1):
+            row += [min(previous[j] + 1, row[j-1] + 1, previous[j-1] + (ca != cb))]
+
+        if min(row) > limit:
+            return min(row)
+
+    return row[-1]
+
+class NameIndex:
+    """ Hash indexes of model IDs by exact name, and by exact display name,
+    alternative spelling or alias, kept up to date by ModelInfo and Model
+    as models are added, changed and removed.
+    """
+
+    ALIAS_KEYS = ("display_name", "alt_spelling", "aliases")
+
+    def __init__(self, models=()):
+        self.names = collections.defaultdict(set)
+        self.aliases = collections.defaultdict(set)
+
+        for model in models:
+            self.add(model)
+
+    @classmethod
+    def model_aliases(cls, model):
+        aliases = [model[key] for key in ("display_name", "alt_spelling") if key in model]
+        return aliases + model.get("aliases", [])
+
+    def add(self, model):
+        self.names[model["name"]].add(model.model_id)
+        for alias in self.model_aliases(model):
+            self.aliases[alias].add(model.model_id)
+
+    def remove(self, model):
+        self.names[model["name"]].discard(model.model_id)
+        for alias in self.model_aliases(model):
+            self.aliases[alias].discard(model.model_id)
+
+def journal_file(info_file):
+    "returns the location of the change journal for a model info file"
+    info_file = pathlib.Path(info_file)
+    return info_file.with_name(info_file.name + ".journal")
+
+class ModelInfo(collections.UserDict):
+    """ The model info file, plus any changes in its journal. Used as a
+    context manager, it saves the models that were changed on exit, and
+    writes nothing if none were.
+
+    Changes are saved by atomically rewriting the whole info file, unless
+    journal_size is given; then they are appended to the journal (one JSON
+    object per line) instead, and the journal is only compacted into the
+    info file once it holds more than journal_size entries. The journal is
+    always replayed when the info file is read.
+    """
+
+    def __init__(self, info_file, journal_size=None):
         self.info_file = info_file
+        self.journal_file = journal_file(info_file)
+        self.journal_size = journal_size
+
         with open(info_file) as file:
             info = json.load(file)
 
@@ -69,52 +302,143 @@ class ModelInfo(collections.UserDict):
 
             self.data[model_id] = Model(model_id, model_data)
 
-    def extensive_name_search(self, query):
-        best_results = collections.defaultdict(lambda: math.inf)
+        # the IDs of models that have been deleted since the info file was read
+        self.deleted = set()
+        self.replay_journal()
+
+        self.name_index = NameIndex(self.data.values())
+        for model in self.data.values():
+            model.name_index = self.name_index
 
-        for model in self.values():
-            if "alt_spelling" in model:
-                d = min_substring_distance(model["alt_spelling"], query)
-                best_results[model.model_id] = min(d, best_results[model.model_id])
+    def replay_journal(self):
+        "applies the changes in the journal, and notes how many there were and where the last complete one ends"
+        self.journal_entries = self.journal_length = 0
+        if not self.journal_file.exists():
+            return
 
-            if "display_name" in model:
-                d = min_substring_distance(model["display_name"], query)
-                best_results[model.model_id] = min(d, best_results[model.model_id])
+        with open(self.journal_file, "rb") as file:
+            lines = file.read().split(b"\n")
 
-            if "aliases" in model:
-                for alias in model["aliases"]:
-                    d = min_substring_distance(alias, query)
-                    best_results[model.model_id] = min(d, best_results[model.model_id])
+        # a crash while appending can only have cut off the last entry, which won't end with a newline
+        if lines[-1]:
+            print(f"ignoring incomplete last entry in {self.journal_file}")
 
-            if not model["name"].startswith("$"):
-                d = min_substring_distance(model["name"], query)
-                best_results[model.model_id] = min(d, best_results[model.model_id])
+        for line in lines[:-1]:
+            entry = json.loads(line)
+
+            if entry.get("deleted", False):
+                self.data.pop(entry["model_id"], None)
+            else:
+                self.data[entry["model_id"]] = Model(entry["model_id"], entry["model"])
+
+            self.journal_entries += 1
+            self.journal_length += len(line) + 1
+
+    def __setitem__(self, model_id, model):
+        if not isinstance(model, Model):
+            model = Model(model_id, model)
+        if model_id not in self.data or self.data[model_id] != model:
+            model.dirty = True
+        else:
+            model.dirty = self.data[model_id].dirty
+
+        if model_id in self.data:
+            self.name_index.remove(self.data[model_id])
+        self.name_index.add(model)
+        model.name_index = self.name_index
+
+        self.data[model_id] = model
+        self.deleted.discard(model_id)
+
+    def __delitem__(self, model_id):
+        self.name_index.remove(self.data[model_id])
+        self.data[model_id].name_index = None
+        del self.data[model_id]
+        self.deleted.add(model_id)
+
+    @property
+    def changed(self):
+        "the IDs of the models that have been added or modified since the info file was read"
+        return [model_id for model_id, model in self.data.items() if model.dirty]
+
+    def save(self):
+        "writes out any changes; see the class docstring"
+        changed = self.changed
+        if not changed and not self.deleted:
+            return
+
+        entries = [{"model_id": model_id, "model": dict(self.data[model_id])} for model_id in changed]
+        entries += [{"model_id": model_id, "deleted": True} for model_id in sorted(self.deleted)]
+
+        if self.journal_size and self.journal_entries + len(entries) <= self.journal_size:
+            with open(self.journal_file, "ab") as file:
+                # drop any incomplete entry before appending
+                file.truncate(self.journal_length)
+                for entry in entries:
+                    line = json.dumps(entry, cls=UserDictJSONEncoder, ensure_ascii=False, sort_keys=True) + "\n"
+                    file.write(line.encode("utf-8"))
+                    self.journal_length += len(line.encode("utf-8"))
+                file.flush()
+                os.fsync(file.fileno())
+            self.journal_entries += len(entries)
+        else:
+            self.compact()
+
+        for model_id in changed:
+            self.data[model_id].dirty = False
+        self.deleted = set()
+
+    def compact(self):
+        "rewrites the info file with every change and removes the journal"
+        js = json.dumps(self.data, cls=UserDictJSONEncoder, ensure_ascii=False, indent=4, sort_keys=True)
+        # a durable atomic_write only returns once the new info file and its rename are on disk, so the
+        # journal is only removed after that; if this is interrupted, replaying the journal again just
+        # repeats changes that are already in the info file
+        atomic_write(self.info_file, js, durable=True)
+        self.journal_file.unlink(missing_ok=True)
+        self.journal_entries = self.journal_length = 0
+
+    def extensive_name_search(self, query):
+        best_results = collections.defaultdict(lambda: math.inf)
+
+        names = [(model.model_id, name) for model in self.values() for name in model.searchable_names]
+        distances = min_substring_distances([name for _, name in names], query)
+
+        for (model_id, _), d in zip(names, distances):
+            best_results[model_id] = min(d, best_results[model_id])
 
         results = [(self.data[model_id], score) for (model_id, score) in best_results.items()]
         results = sorted(results, key=lambda r: r[1])
         return results[:5]
 
     def find_by_name(self, name):
-        matches = set()
+        return {self.data[model_id] for model_id in self.name_index.names.get(name, ())}
 
-        for model in self.data.values():
-            if model["name"] == name:
-                matches.add(model)
+    def find_by_alias(self, alias):
+        "returns the models with alias as their display name, alternative spelling or one of their aliases"
+        return {self.data[model_id] for model_id in self.name_index.aliases.get(alias, ())}
 
-        return matches
+    def nearest_name(self, name):
+        "returns the model name with the smallest edit distance to name (the first in the info file, if there is a tie)"
+        best, closest = math.inf, None
 
-    def fuzzy_find_by_name(self, name):
-        names = [m["name"] for m in self.data.values()]
-        names = sorted(names, key=lambda x: levenshtein(name, x))
-        return names
+        for model in self.data.values():
+            d = bounded_levenshtein(name, model["name"], best - 1)
+            if d < best:
+                best, closest = d, model["name"]
+                if best == 0:
+                    break
+
+        return closest
 
     def fuzzy_get_model_id(self, query):
         if query in self.data:
             return query
         else:
-            matches = self.find_by_name(query)
+            # aliases are only tried if no model has query as its name
+            matches = self.find_by_name(query) or self.find_by_alias(query)
             if len(matches) == 0:
-                closest = self.fuzzy_find_by_name(query)[0]
+                closest = self.nearest_name(query)
                 raise Exception(f"No matches for {repr(query)}. Did you mean {repr(closest)}?")
             elif len(matches) == 1:
                 return tuple(matches)[0].model_id
@@ -126,45 +450,90 @@ class ModelInfo(collections.UserDict):
 
     def __exit__(self, exc_type, exc_value, traceback):
         if exc_type is None:
-            js = json.dumps(self.data, cls=UserDictJSONEncoder, ensure_ascii=False, indent=4, sort_keys=True)
-            with open(self.info_file, "w") as file:
-                file.write(js)
+            self.save()
         else:
             print(f"ModelInfo encountered an exception and has exited without writing to the info file ({self.info_file})")
 
-class Model(collections.UserDict):
+class Model(SlottedMapping):
     mandatory_keys = ("name", "biography", "links")
     optional_keys = ("alt_spelling", "display_name", "aliases")
     all_keys = set(mandatory_keys + optional_keys)
 
+    KEYS = mandatory_keys + optional_keys
+    __slots__ = SlottedMapping.slot_names(KEYS) + ("model_id", "dirty", "name_index")
+
     def __init__(self, model_id, data):
         if not set(data.keys()).issubset(self.all_keys):
-            raise Exception(f"{self.__class__.__name__} initialised with unknown keys {all_keys - set(data.keys())}")
+            raise Exception(f"{self.__class__.__name__} initialised with unknown keys {set(data.keys()) - self.all_keys}")
 
         self.model_id = model_id
-        self.data = data
+        # the NameIndex of the ModelInfo the model belongs to, if any
+        self.name_index = None
+
+        for key, value in data.items():
+            super().__setitem__(key, value)
+
+        # whether the model has been changed since it was loaded; changes inside its values (e.g. appending to its links) aren't noticed
+        self.dirty = False
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            self.dirty = True
+
+        if self.name_index is not None and key in ("name",) + NameIndex.ALIAS_KEYS:
+            self.name_index.remove(self)
+            super().__setitem__(key, value)
+            self.name_index.add(self)
+        else:
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if self.name_index is not None and key in NameIndex.ALIAS_KEYS:
+            self.name_index.remove(self)
+            super().__delitem__(key)
+            self.name_index.add(self)
+        else:
+            super().__delitem__(key)
+        self.dirty = True
 
     def __hash__(self):
-        return int.from_bytes(bytes(self.model_id, "utf-8"), "big")
+        # str caches its own hash, so this is only computed once per model ID
+        return hash(self.model_id)
 
     @property
     def links_block(self):
-        return "\n".join(" * " + L for L in self.data["links"])
+        return "\n".join(" * " + L for L in self["links"])
 
     @property
     def display_name(self):
-        if "display_name" in self.data:
-            return self.data["display_name"]
+        if "display_name" in self:
+            return self["display_name"]
         else:
-            return self.data["name"]
+            return self["name"]
+
+    @property
+    def searchable_names(self):
+        "the names that a search for this model is matched against"
+        names = []
+
+        if "alt_spelling" in self:
+            names += [self["alt_spelling"]]
+        if "display_name" in self:
+            names += [self["display_name"]]
+        names += self.get("aliases", [])
+        # placeholder names ($<model ID>) are not searchable
+        if not self["name"].startswith("$"):
+            names += [self["name"]]
+
+        return names
 
 class SiteModelInfo:
 
     class ModelsToItems:
 
-        def __init__(self, site_models, item_ids):
+        def __init__(self, site_models, site):
             self.site_models = site_models
-            self.item_ids = item_ids
+            self.site = site
 
             self.models_to_items = {}
 
@@ -182,12 +551,13 @@ class SiteModelInfo:
                         raise Exception()
 
                 for pattern in patterns:
-                    if pattern in self.item_ids:
+                    if pattern in self.site:
                         self.models_to_items[model_id] += [pattern]
-                    elif (matches := pattern_filter(self.item_ids, pattern)):
+                    elif (matches := self.site.match_items(pattern)):
                         self.models_to_items[model_id] += matches
                     else:
-                        raise Exception(f"{pattern} matched no items")
+                        # a stale pattern shouldn't stop every page that lists this model's appearances from being built
+                        print(f"{self.site.site_id}: {pattern} (credited to {model_id}) matched no items")
 
             self.models_to_items[model_id] = self.models_to_items[model_id]
             return self.models_to_items[model_id]
@@ -202,41 +572,42 @@ class SiteModelInfo:
 
         Credit = collections.namedtuple("Credit", ("model_name", "model_id"))
 
-        def __init__(self, site_models, item_ids, model_info):
+        def __init__(self, site_models, site, model_info):
             self.site_models = site_models
-            self.item_ids = item_ids
+            self.site = site
             self.model_info = model_info
 
-            self.items_to_models = {}
+            items_to_models = collections.defaultdict(list)
+
+            for model_id, credits in self.site_models.items():
+                for p in credits:
+                    model_name = self.model_info[model_id].display_name
+                    if isinstance(p, str):
+                        patterns = [p]
+                        credit = self.Credit(model_name, model_id)
+                    elif isinstance(p, dict):
+                        patterns = p["items"]
+
+                        if "credited_as" in p:
+                            model_name += f" (as {p['credited_as']})"
+                        credit = self.Credit(model_name, model_id)
+                    else:
+                        raise Exception()
+
+                    matches = set()
+                    for pattern in patterns:
+                        matches.update(self.site.match_items(pattern))
+
+                    for item_id in matches:
+                        items_to_models[item_id] += [credit]
+
+            self.items_to_models = {item_id: sorted(credits) for item_id, credits in items_to_models.items()}
 
         def __getitem__(self, item_id):
-            if item_id not in self.items_to_models:
-                self.items_to_models[item_id] = []
-                for model_id in self.site_models:
-
-                    for p in self.site_models[model_id]:
-                        model_name = self.model_info[model_id].display_name
-                        if isinstance(p, str):
-                            patterns = [p]
-                            credit = self.Credit(model_name, model_id)
-                        elif isinstance(p, dict):
-                            patterns = p["items"]
-
-                            if "credited_as" in p:
-                                model_name += f" (as {p['credited_as']})"
-                            credit = self.Credit(model_name, model_id)
-                        else:
-                            raise Exception()
-
-                        for pattern in patterns:
-                            if pattern_match(item_id, pattern):
-                                self.items_to_models[item_id] += [credit]
-                                break
-
-            self.items_to_models[item_id] = sorted(self.items_to_models[item_id])
-            return self.items_to_models[item_id]
-
-    def __init__(self, models_file, model_info, item_ids):
+            return self.items_to_models.get(item_id, [])
+
+    def __init__(self, models_file, model_info, site):
+        "site is the SiteInfo (or anything else with a site_id, item IDs as keys and a match_items method) that the models file is for"
 
         if models_file is None:
             site_models = {}
@@ -247,15 +618,21 @@ class SiteModelInfo:
             with models_file.open() as file:
                 site_models = json.load(file)
 
-        self.models = self.ModelsToItems(site_models, item_ids)
-        self.items = self.ItemsToModels(site_models, item_ids, model_info)
+        # a model may be given a single credit dict instead of a list of credits
+        site_models = {m: [c] if isinstance(c, dict) else c for m, c in site_models.items()}
+
+        self.models = self.ModelsToItems(site_models, site)
+        self.items = self.ItemsToModels(site_models, site, model_info)
 
 class UserDictJSONEncoder(json.JSONEncoder):
+    "encodes UserDicts and other mappings (Models, Items, ...) as JSON objects"
     def default(self, o):
         if isinstance(o, collections.UserDict):
             return o.data
+        elif isinstance(o, collections.abc.Mapping):
+            return dict(o)
         else:
-            return super().default(self, o)
+            return super().default(o)
 
 if __name__ == "__main__":
     with ModelInfo("/Users/benzlock/Desktop/mhg1o/canon/model-info.json") as mi:
@@ -3,26 +3,72 @@
 import collections
 import json
 import pathlib
+import sys
 
+import cache
 import item
 
 from human_sort import human_sort
 from get_files import get_file_list
 
 class RelationInfo(collections.UserDict):
+    """ The relations between items. Each relation group is stored once, as a
+    human-sorted tuple of interned (site ID, item ID) keys, and self.data
+    maps each key to the index of its group in self.groups. An item that is
+    in more than one group only keeps the last one; such items are listed
+    in self.duplicates and reported when the relations are loaded.
 
-    def __init__(self, root, sites):
+    Related items are looked up in sites, a mapping of site IDs to mappings
+    of item IDs to items (or anything else with the item_id, internal_url
+    and site_name that pages link to them with, such as ItemSummaries).
+
+    If cache_dir is given, the loaded relations are cached there until any
+    relation file is added, removed or modified.
+    """
+
+    def __init__(self, root, sites, cache_dir=None):
         if isinstance(root, str):
             root = pathlib.Path(root)
 
-        self.data = {}
-
         self.sites = sites
         self.root = root
 
-        for relation_file in get_file_list(root):
-            if relation_file.suffix != ".json":
-                continue
+        relation_files = [f for f in get_file_list(root) if f.suffix == ".json"]
+
+        if cache_dir is None:
+            self.load_relation_files(relation_files)
+        else:
+            cache_file = cache_dir/"relations.pickle"
+            key = (cache.file_key(*relation_files), str(root))
+
+            if (state := cache.load(cache_file, key)) is None:
+                self.load_relation_files(relation_files)
+                state = (self.data, self.groups, self.site_files, self.linked_sites, self.duplicates)
+                cache.store(cache_file, key, state)
+            else:
+                self.data, self.groups, self.site_files, self.linked_sites, self.duplicates = state
+
+        for (site_id, item_id), files in self.duplicates.items():
+            files = ", ".join(str(f.relative_to(root)) for f in files)
+            print(f"{site_id}/{item_id} is in more than one relation group ({files}); only the last one is kept")
+
+    def load_relation_files(self, relation_files):
+        """ Parses the relation files and merges them in order. They are parsed
+        one at a time: json.load holds the GIL, so threads don't help, and
+        sending the parsed files back from worker processes costs more than
+        parsing them. The cache is what makes loading them fast.
+        """
+        self.data = {}
+        self.groups = []
+        # site ID -> relation files that mention the site, and the other sites they relate it to
+        self.site_files = collections.defaultdict(set)
+        self.linked_sites = collections.defaultdict(set)
+
+        keys = {}
+        # (site ID, item ID) -> the relation file of each group it is in
+        occurrences = collections.defaultdict(list)
+
+        for relation_file in relation_files:
             with relation_file.open() as file:
                 relations = json.load(file)
 
@@ -31,17 +77,29 @@ class RelationInfo(collections.UserDict):
 
                 for items in relations_list:
                     items = [(*prefix, *item.split("/")) for item in items]
-                    items = [("/".join(i[:2]), "/".join(i[2:])) for i in items]
-                    items = set(items)
+                    items = [(sys.intern("/".join(i[:2])), sys.intern("/".join(i[2:]))) for i in items]
+                    items = {keys.setdefault(i, i) for i in items}
+
+                    site_ids = {site_id for site_id, _ in items}
+                    for site_id in site_ids:
+                        self.site_files[site_id].add(relation_file)
+                        self.linked_sites[site_id] |= site_ids - {site_id}
+
+                    group_number = len(self.groups)
+                    self.groups += [tuple(sorted(items, key=human_sort))]
+                    for key in items:
+                        self.data[key] = group_number
+                        occurrences[key] += [relation_file]
 
-                    for item_id in items:
-                        (r := items.copy()).remove(item_id)
+        self.duplicates = {key: files for key, files in occurrences.items() if len(files) > 1}
 
-                        self.data[item_id] = sorted(list(r), key=human_sort)
+    def related(self, key):
+        "returns the keys of the items related to the one with the given key, in human sort order"
+        return [k for k in self.groups[self.data[key]] if k != key]
 
     def __getitem__(self, key):
 
-        for site_id, item_id in self.data[key]:
+        for site_id, item_id in self.related(key):
 
             yield self.sites[site_id][item_id]
 
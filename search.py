@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import bisect
+import collections
+import math
+
+from model import min_substring_distance
+
+class NameSearchIndex:
+    """ An index over the searchable names of the models in a ModelInfo that
+    gives the same results as ModelInfo.extensive_name_search, but only
+    computes edit distances for the models that could make the cut.
+
+    Names are indexed by their q-grams. By the q-gram lemma, if the shorter
+    of a name and the query matches a substring of the longer one with d
+    edits, then at least (length - q + 1) - q*d of the shorter string's
+    q-grams occur in the longer one, which gives a lower bound for d that
+    can be computed from the posting lists alone. Models are then scored in
+    order of their lower bound until no remaining model can reach the top
+    results.
+
+    Names are normalised with str.lower(), the same way as
+    min_substring_distance normalises them, so that the bounds hold exactly.
+    """
+
+    Q = 2
+
+    def __init__(self, model_info):
+        self.model_info = model_info
+
+        self.models = []
+        # name number -> (model number, name)
+        self.names = []
+        # model number -> name numbers
+        self.model_names = []
+        # q-gram -> {name number: number of positions in the name with that q-gram}
+        self.postings = collections.defaultdict(collections.Counter)
+
+        for model in model_info.values():
+            model_number = len(self.models)
+            self.models += [model]
+            self.model_names += [[]]
+
+            for name in model.searchable_names:
+                name_number = len(self.names)
+                self.names += [(model_number, name)]
+                self.model_names[model_number] += [name_number]
+
+                for gram in self.qgrams(name.lower()):
+                    self.postings[gram][name_number] += 1
+
+    @classmethod
+    def qgrams(cls, s):
+        return [s[i:i+cls.Q] for i in range(len(s) - cls.Q + 1)]
+
+    def name_bounds(self, query):
+        "returns a lower bound for min_substring_distance(name, query) for each name number"
+        query_grams = self.qgrams(query.lower())
+
+        # for each name, the number of positions in the query whose q-gram occurs in the name...
+        query_shared = collections.Counter()
+        for gram in query_grams:
+            if gram in self.postings:
+                query_shared.update(self.postings[gram].keys())
+
+        # ...and the number of positions in the name whose q-gram occurs in the query
+        name_shared = collections.Counter()
+        for gram in set(query_grams):
+            if gram in self.postings:
+                name_shared.update(self.postings[gram])
+
+        bounds = []
+        for name_number, (_, name) in enumerate(self.names):
+            # min_substring_distance slides the shorter string (the name, if they are equally long) over the longer one
+            if len(query) < len(name):
+                shorter, shared = query, query_shared[name_number]
+            else:
+                shorter, shared = name, name_shared[name_number]
+
+            missing = (len(shorter) - self.Q + 1) - shared
+            bounds += [max(0, math.ceil(missing / self.Q))]
+
+        return bounds
+
+    def score(self, model_number, query, bounds, limit=None):
+        "returns the model's score, or some number greater than limit if its score is greater than limit"
+        best = math.inf
+        for name_number in sorted(self.model_names[model_number], key=bounds.__getitem__):
+            if bounds[name_number] >= best:
+                break
+            best = min(best, min_substring_distance(self.names[name_number][1], query, limit=limit))
+        return best
+
+    def search(self, query, limit=5, seeds=()):
+        """ Returns up to limit (model, score) pairs, best first, exactly as
+        ModelInfo.extensive_name_search would. seeds is an optional iterable
+        of model IDs that are likely to score well (e.g. the results for a
+        prefix of the query); scoring them first lets the search stop sooner.
+        """
+        bounds = self.name_bounds(query)
+
+        model_bounds = {
+                model_number: min(bounds[n] for n in name_numbers)
+                for model_number, name_numbers in enumerate(self.model_names)
+                if name_numbers
+                }
+
+        model_numbers = {model.model_id: n for n, model in enumerate(self.models)}
+        seeds = [model_numbers[s] for s in seeds if s in model_numbers and model_numbers[s] in model_bounds]
+        candidates = seeds + sorted(model_bounds, key=lambda n: (model_bounds[n], n))
+
+        scores = {}
+        # the best (score, model number) pairs so far; a model can only enter the results if it beats top[-1]
+        top = []
+        for model_number in candidates:
+            if model_number in scores:
+                continue
+            if len(top) == limit and (model_bounds[model_number], model_number) > top[-1]:
+                if model_number in seeds:
+                    continue
+                break
+
+            # a model that can't beat the current last result doesn't need an exact score
+            cutoff = top[-1][0] if len(top) == limit else None
+            scores[model_number] = self.score(model_number, query, bounds, cutoff)
+
+            bisect.insort(top, (scores[model_number], model_number))
+            del top[limit:]
+
+        results = sorted(scores.items(), key=lambda s: (s[1], s[0]))[:limit]
+        return [(self.models[model_number], score) for model_number, score in results]
+
+    def to_json(self, model_image):
+        """ Returns a compact JSON-serialisable form of the index, which
+        searchModels in static/script.js answers queries from in the same way
+        as NameSearchIndex.search. Names are stored already lower-cased, and
+        each posting list is flattened to [name number, count, ...].
+        """
+        return {
+                "q": self.Q,
+                "models": [[model.model_id, model.display_name, model_image(model.model_id)] for model in self.models],
+                "names": [[model_number, name.lower()] for model_number, name in self.names],
+                "postings": {gram: [x for posting in postings.items() for x in posting] for gram, postings in self.postings.items()},
+                }
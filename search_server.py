@@ -1,14 +1,104 @@
 #!/usr/bin/env python3
 
+import collections
+import threading
+import time
+
+import click
 import flask
+import werkzeug.serving
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+from images import ModelImages
+from model import ModelInfo, journal_file
+from manage import root, global_config
+from search import NameSearchIndex
+
+class SearchService:
+    """ Answers model searches from a NameSearchIndex. Results are kept in an
+    LRU cache, and a miss is seeded with the cached results for the longest
+    cached prefix of the query, which are usually still near the top while
+    the user is typing. The model info file is reloaded when it changes on
+    disk, and the model images are tracked by a ModelImages.
+    """
+
+    # how often (in seconds) to check whether the model info file or the model images have changed
+    CHECK_INTERVAL = 1
+
+    def __init__(self, info_file, image_dir, image_depth, cache_size=1024):
+        self.info_file = info_file
+        self.images = ModelImages(image_dir, self.CHECK_INTERVAL)
+        self.image_depth = image_depth
+        self.cache_size = cache_size
+
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+
+        self.info_mtime = None
+        self.checked = 0
+        self.reload()
+
+    def reload(self):
+        with self.reload_lock:
+            # changes may only have been appended to the journal
+            info_mtime = self.info_file.stat().st_mtime_ns
+            if (journal := journal_file(self.info_file)).exists():
+                info_mtime = (info_mtime, journal.stat().st_mtime_ns)
 
-from model import ModelInfo
-from manage import model_image_func
+            if info_mtime != self.info_mtime:
+                index = NameSearchIndex(ModelInfo(self.info_file))
+                with self.lock:
+                    self.index = index
+                    self.info_mtime = info_mtime
+                    self.cache.clear()
+
+            self.checked = time.monotonic()
+
+    def model_image(self, model_id):
+        if model_id in self.images:
+            return (self.image_depth * "../") + f"static/model-images/{model_id}.jpg"
+        else:
+            return (self.image_depth * "../") + "static/default-model-img.jpg"
+
+    def search(self, query):
+        "returns a list of (model ID, display name) pairs for the best matches for query"
+        if time.monotonic() - self.checked > self.CHECK_INTERVAL:
+            self.reload()
+
+        with self.lock:
+            index = self.index
+            if query in self.cache:
+                self.cache.move_to_end(query)
+                return self.cache[query]
+
+            seeds = ()
+            for end in range(len(query) - 1, 0, -1):
+                if query[:end] in self.cache:
+                    seeds = [model_id for model_id, _ in self.cache[query[:end]]]
+                    break
+
+        results = [(model.model_id, model.display_name) for model, _ in index.search(query, seeds=seeds)]
+
+        with self.lock:
+            if index is self.index:
+                self.cache[query] = results
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        return results
 
 app = flask.Flask("search server")
 
-mi = ModelInfo("/Users/benzlock/Desktop/mhg1o/canon/model-info.json")
-model_image = model_image_func(3)
+service = SearchService(
+        root/global_config["models_file"],
+        root/global_config["static_files"]/"model-images",
+        image_depth=3
+        )
 
 @app.route("/api/search")
 def search():
@@ -18,17 +108,30 @@ def search():
         return flask.jsonify({})
 
     response = []
-    for model, score in mi.extensive_name_search(query)[:4]:
+    for model_id, name in service.search(query)[:4]:
         response += [
                 {
-                    "name": model.display_name,
-                    "model_id": model.model_id,
-                    "image": model_image(model.model_id)
+                    "name": name,
+                    "model_id": model_id,
+                    "image": service.model_image(model_id)
                     }
                 ]
 
-    print(response)
     return flask.jsonify(response)
 
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=5000)
+@click.option("--threads", default=8, help="number of worker threads (when waitress is installed)")
+@click.option("--debug", is_flag=True, help="run Flask's single-user development server with the debugger")
+def main(host, port, threads, debug):
+    if debug:
+        app.run(host=host, port=port, debug=True)
+    elif waitress is not None:
+        waitress.serve(app, host=host, port=port, threads=threads)
+    else:
+        # without waitress, fall back to werkzeug's server with a thread per request
+        werkzeug.serving.make_server(host, port, app, threaded=True).serve_forever()
+
 if __name__ == "__main__":
-    app.run(port=5000, debug=True)
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import collections.abc
+
+class SlottedMapping(collections.abc.MutableMapping):
+    """ A mapping whose keys all come from a schema (KEYS) shared by every
+    instance of the class, with each value kept in its own slot instead of
+    in a per-instance dict. A subclass lists its keys in KEYS and includes
+    slot_names(KEYS) in its __slots__. Keys are iterated in schema order.
+    """
+
+    __slots__ = ()
+    KEYS = ()
+
+    @staticmethod
+    def slot_names(keys):
+        return tuple("_" + key for key in keys)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # key -> name of the slot that holds its value
+        cls.slot_of = dict(zip(cls.KEYS, cls.slot_names(cls.KEYS)))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.slot_of[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.slot_of:
+            raise Exception(f"{self.__class__.__name__} has no key {repr(key)}")
+        setattr(self, self.slot_of[key], value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self.slot_of[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.slot_of and hasattr(self, self.slot_of[key])
+
+    def __iter__(self):
+        return (key for key, slot in self.slot_of.items() if hasattr(self, slot))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)!r})"
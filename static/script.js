@@ -29,12 +29,157 @@ function toggleAll() {
 
 }
 
-function processSearch(inp) {
+function followItemLink(itemPages) {
+    // on a paginated site index, send a link to #<item ID> on the wrong page (e.g. index.html) to the item's page
+    const itemId = decodeURIComponent(location.hash.slice(1));
+    if (!(itemId in itemPages)) {
+        return;
+    }
+
+    const page = itemPages[itemId];
+    const current = location.pathname.split("/").pop() || "index.html";
+    if (page != current) {
+        location.replace(page + location.hash);
+    }
+}
+
+function qgrams(s, q) {
+    const grams = [];
+    for (let i = 0; i + q <= s.length; i++) {
+        grams.push(s.slice(i, i + q));
+    }
+    return grams;
+}
+
+// the smallest edit distance between pattern and any substring of text (see substring_distance in model.py)
+function substringDistance(pattern, text, limit) {
+    let row = new Array(text.length + 1).fill(0);
+
+    for (let i = 1; i <= pattern.length; i++) {
+        const previous = row;
+        row = [i];
+        for (let j = 1; j <= text.length; j++) {
+            const substitution = previous[j - 1] + (pattern[i - 1] == text[j - 1] ? 0 : 1);
+            row.push(Math.min(substitution, previous[j] + 1, row[j - 1] + 1));
+        }
+
+        const m = Math.min(...row);
+        if (limit !== null && m > limit) {
+            return m;
+        }
+    }
+
+    return Math.min(...row);
+}
+
+// the shorter string (the name, if they are equally long) is matched against the longer one, as in min_substring_distance
+function minSubstringDistance(name, query, limit) {
+    if (query.length < name.length) {
+        return substringDistance(query, name, limit);
+    } else {
+        return substringDistance(name, query, limit);
+    }
+}
+
+function prepareSearchIndex(index) {
+    if (index.modelNames === undefined) {
+        index.modelNames = index.models.map(function() { return []; });
+        index.names.forEach(function([modelNumber, name], n) {
+            index.modelNames[modelNumber].push(n);
+        });
+        index.postings = new Map(Object.entries(index.postings));
+    }
+    return index;
+}
+
+// returns the IDs of the best matches for query, ranked as NameSearchIndex.search in search.py ranks them
+function searchModels(index, query, limit) {
+    index = prepareSearchIndex(index);
+    query = query.toLowerCase();
+
+    const q = index.q;
+    const queryGrams = qgrams(query, q);
+
+    const queryShared = new Map();
+    queryGrams.forEach(function(gram) {
+        const postings = index.postings.get(gram) || [];
+        for (let k = 0; k < postings.length; k += 2) {
+            queryShared.set(postings[k], (queryShared.get(postings[k]) || 0) + 1);
+        }
+    });
+
+    const nameShared = new Map();
+    new Set(queryGrams).forEach(function(gram) {
+        const postings = index.postings.get(gram) || [];
+        for (let k = 0; k < postings.length; k += 2) {
+            nameShared.set(postings[k], (nameShared.get(postings[k]) || 0) + postings[k + 1]);
+        }
+    });
+
+    const modelBounds = new Map();
+    const bounds = index.names.map(function([modelNumber, name], n) {
+        let shorter = name;
+        let shared = nameShared.get(n) || 0;
+        if (query.length < name.length) {
+            shorter = query;
+            shared = queryShared.get(n) || 0;
+        }
+
+        const bound = Math.max(0, Math.ceil((shorter.length - q + 1 - shared) / q));
+        if (!modelBounds.has(modelNumber) || bound < modelBounds.get(modelNumber)) {
+            modelBounds.set(modelNumber, bound);
+        }
+        return bound;
+    });
+
+    const candidates = Array.from(modelBounds.keys());
+    candidates.sort(function(a, b) { return (modelBounds.get(a) - modelBounds.get(b)) || (a - b); });
+
+    const before = function(a, b) { return a[0] < b[0] || (a[0] == b[0] && a[1] < b[1]); };
+
+    // the best [score, model number] pairs so far
+    let top = [];
+    for (const modelNumber of candidates) {
+        if (top.length == limit && before(top[limit - 1], [modelBounds.get(modelNumber), modelNumber])) {
+            break;
+        }
+
+        const cutoff = top.length == limit ? top[limit - 1][0] : null;
+        const names = index.modelNames[modelNumber].slice().sort(function(a, b) { return bounds[a] - bounds[b]; });
+        let score = Infinity;
+        for (const n of names) {
+            if (bounds[n] >= score) {
+                break;
+            }
+            score = Math.min(score, minSubstringDistance(index.names[n][1], query, cutoff));
+        }
+
+        top.push([score, modelNumber]);
+        top.sort(function(a, b) { return before(a, b) ? -1 : 1; });
+        top = top.slice(0, limit);
+    }
+
+    return top.map(function([score, modelNumber]) { return index.models[modelNumber][0]; });
+}
+
+function processSearch(inp, index) {
+    let shown = [];
+
     inp.addEventListener("input", function(e) {
-        req = new XMLHttpRequest();
-        req.open("GET", "http://localhost:5000/api/search?query=" + encodeURIComponent(this.value));
-        req.send();
-        console.log(req.response);
+        shown.forEach(hideSearchResult);
+        shown = [];
+
+        if (this.value == "") {
+            return;
+        }
+
+        searchModels(index, this.value, 4).forEach(function(model_id) {
+            // move each result to the end of its row so that the results appear in ranked order
+            const result = document.getElementById("search_result_" + model_id);
+            result.parentElement.appendChild(result);
+            revealSearchResult(model_id);
+            shown.push(model_id);
+        });
     });
 }
 